@@ -1,35 +1,83 @@
 # app.py
+import time
 import streamlit as st
 from dotenv import load_dotenv
 load_dotenv()
 
-from graph import app
+from config import RETRIEVAL_K, RETRIEVAL_FILTER, RETRIEVAL_MODE, JUDGE_MODE, PREWARM_RESOURCES
+from state import initial_state
+from utils import resources
+from utils.instrumentation import invoke_traced, setup_logging
 
+setup_logging()
 st.set_page_config(page_title="🧠 Research Assistant", layout="wide")
+
+
+@st.cache_resource(show_spinner=False)
+def load_pipeline():
+    """
+    Граф компилируется один раз на процесс и делится всеми сессиями.
+    Модели грузятся лениво (utils/resources.py) или заранее в фоне при PREWARM_RESOURCES.
+    """
+    started = time.perf_counter()
+    from graph import app
+    import_time = round(time.perf_counter() - started, 3)
+    if PREWARM_RESOURCES:
+        resources.prewarm()
+    return app, import_time
+
+
+app, graph_import_time = load_pipeline()
+
+from nodes.retrieve_evidence import FILTER_FLAGS, RETRIEVAL_MODES
+from nodes.validate_evidence import JUDGE_MODES
+
 st.title("🧠 Research Assistant — Научный ассистент с доказательствами")
 
 question = st.text_input("Введите научный вопрос:", placeholder="Какие методы снижают KV-cache?")
 
+with st.sidebar:
+    st.markdown("### ⚙️ Поиск доказательств")
+    retrieval_k = st.number_input("Чанков на гипотезу (k)", min_value=1, max_value=20, value=RETRIEVAL_K)
+    retrieval_filter = st.multiselect(
+        "Искать только в чанках с флагами",
+        options=FILTER_FLAGS,
+        default=RETRIEVAL_FILTER
+    )
+    retrieval_mode = st.radio(
+        "Режим поиска",
+        options=RETRIEVAL_MODES,
+        index=RETRIEVAL_MODES.index(RETRIEVAL_MODE) if RETRIEVAL_MODE in RETRIEVAL_MODES else 0,
+        help="dense — эмбеддинги всех чанков; hybrid — BM25 отбирает кандидатов, эмбеддятся только они"
+    )
+    st.markdown("### ⚖️ LLM-судья")
+    judge_mode = st.radio(
+        "Режим проверки",
+        options=JUDGE_MODES,
+        index=JUDGE_MODES.index(JUDGE_MODE) if JUDGE_MODE in JUDGE_MODES else 0,
+        help="per_chunk — запрос на каждый фрагмент; batched — один запрос на гипотезу"
+    )
+    with st.expander("⏱️ Загрузка ресурсов, с"):
+        st.json({"import graph": graph_import_time, **resources.timings()})
+
 if st.button("🔍 Запустить анализ"):
     if not question.strip():
         st.error("Введите вопрос!")
     else:
-        initial_state = {
-            "question": question,
-            "papers": [],
-            "chunks_with_metadata": [],
-            "hypotheses": [],
-            "evidence": [],
-            "final_answer": "",
-            "retry_count": 0,
-            "error": ""
-        }
+        state = initial_state(
+            question,
+            retrieval_k=int(retrieval_k),
+            retrieval_filter=retrieval_filter,
+            retrieval_mode=retrieval_mode,
+            judge_mode=judge_mode
+        )
 
         with st.spinner("🚀 Анализ выполняется..."):
             try:
                 # ⚡ Единственный вызов — LangGraph делает всё
-                final_state = app.invoke(
-                    initial_state,
+                final_state, trace = invoke_traced(
+                    app,
+                    state,
                     config={"recursion_limit": 10}  # достаточно для 1 повтора
                 )
                 
@@ -37,6 +85,21 @@ if st.button("🔍 Запустить анализ"):
                 st.markdown("### 📝 Ответ")
                 st.markdown(final_state["final_answer"])
 
+                judge_stats = final_state.get("judge_stats")
+                if judge_stats:
+                    st.caption(
+                        f"⚖️ Судья ({judge_stats['mode']}): {judge_stats['llm_calls']} запросов "
+                        f"(сэкономлено {judge_stats.get('llm_calls_saved', 0)}), "
+                        f"{judge_stats['input_tokens']} + {judge_stats['output_tokens']} токенов, "
+                        f"{judge_stats['latency_s']:.1f} с"
+                    )
+
+                with st.expander(f"⏱️ Время по этапам (всего {trace['total_s']:.1f} с)"):
+                    st.dataframe(
+                        [{"этап": node, **record} for node, record in trace["nodes"].items()],
+                        use_container_width=True
+                    )
+
                 st.markdown("### 🔗 Цепочка доказательств")
                 for item in final_state.get("evidence", []):
                     hyp = item.get("hypothesis", "Без названия")
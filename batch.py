@@ -0,0 +1,162 @@
+# batch.py
+"""
+Пакетный режим: прогоняет вопросы из JSONL через граф на пуле потоков.
+
+    python batch.py questions.jsonl answers.jsonl --workers 4
+
+Входной файл — по объекту на строку: {"id": "q1", "question": "...", "max_papers": 5,
+"retrieval_k": 3, "retrieval_filter": [...], "retrieval_mode": "hybrid", "judge_mode": "batched"} (обязателен только question).
+Все вопросы делят одну модель эмбеддингов, один LLM-клиент с его лимитом запросов и общие кэши;
+статью, нужную нескольким вопросам одновременно, скачивают, разбирают и эмбеддят один раз
+(utils/singleflight.py). Результаты дописываются в выходной файл по мере готовности, поэтому
+прерванный запуск продолжается той же командой: уже отвеченные вопросы пропускаются.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from config import BATCH_WORKERS, PREWARM_RESOURCES
+from state import initial_state
+from utils import resources
+from utils.instrumentation import invoke_traced, setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Поля входной строки, которые передаются в состояние графа
+STATE_PARAMS = ("max_papers", "retrieval_k", "retrieval_filter", "retrieval_mode", "judge_mode")
+
+
+def question_key(record: dict) -> str:
+    """Ключ для возобновления: id из входного файла, а если его нет — сам вопрос."""
+    return str(record.get("id") or record["question"])
+
+
+def read_questions(path: str) -> list:
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if not record.get("question"):
+                logger.warning(f"⚠️ Строка {line_no}: нет поля question — пропускаем")
+                continue
+            records.append(record)
+    return records
+
+
+def completed_keys(path: str) -> set:
+    """Вопросы, на которые в выходном файле уже есть успешный ответ."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # недописанная строка после сбоя
+            if result.get("status") == "ok":
+                done.add(result["key"])
+    return done
+
+
+def run_question(graph_app, record: dict) -> dict:
+    params = {name: record.get(name) for name in STATE_PARAMS}
+    state = initial_state(record["question"], **params)
+    started = time.perf_counter()
+    try:
+        final_state, trace = invoke_traced(graph_app, state, config={"recursion_limit": 10})
+    except Exception as e:
+        logger.error(f"❌ Вопрос '{record['question'][:60]}': {e}")
+        return {
+            "key": question_key(record),
+            "id": record.get("id"),
+            "question": record["question"],
+            "status": "error",
+            "error": str(e),
+            "total_s": round(time.perf_counter() - started, 4),
+        }
+    return {
+        "key": question_key(record),
+        "id": record.get("id"),
+        "question": record["question"],
+        "status": "ok",
+        "final_answer": final_state.get("final_answer", ""),
+        "hypotheses": final_state.get("hypotheses", []),
+        "papers": [
+            {"arxiv_id": paper.get("arxiv_id"), "title": paper.get("title"), "pdf_url": paper.get("pdf_url")}
+            for paper in final_state.get("papers", [])
+        ],
+        "evidence": final_state.get("evidence", []),
+        "judge_stats": final_state.get("judge_stats"),
+        "error": final_state.get("error", ""),
+        "total_s": trace["total_s"],
+        "metrics": trace["nodes"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный прогон вопросов через Research Assistant")
+    parser.add_argument("input", help="JSONL с вопросами")
+    parser.add_argument("output", help="JSONL с ответами (дописывается)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="вопросов одновременно")
+    parser.add_argument("--restart", action="store_true", help="начать заново, не учитывая готовые ответы")
+    args = parser.parse_args()
+
+    setup_logging()
+    records = read_questions(args.input)
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = completed_keys(args.output)
+    todo, seen = [], set(done)
+    for record in records:
+        key = question_key(record)
+        if key not in seen:
+            seen.add(key)
+            todo.append(record)
+    logger.info(f"📋 Вопросов: {len(records)}, уже готово: {len(records) - len(todo)}, к запуску: {len(todo)}")
+    if not todo:
+        return
+
+    started = time.perf_counter()
+    from graph import app
+    from nodes.extract_text import shutdown_parse_pool
+    if PREWARM_RESOURCES:
+        # Загружаем модели до старта воркеров, чтобы первые вопросы не ждали друг друга
+        resources.prewarm(background=False)
+
+    failed = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="batch")
+    try:
+        futures = [executor.submit(run_question, app, record) for record in todo]
+        with open(args.output, "a", encoding="utf-8") as out:
+            for n, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                failed += result["status"] != "ok"
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                logger.info(f"✅ [{n}/{len(todo)}] {result['status']}: {result['question'][:60]}")
+    except KeyboardInterrupt:
+        logger.warning("⏹️ Прервано — повторный запуск с теми же файлами продолжит с места остановки")
+        executor.shutdown(wait=False, cancel_futures=True)
+        sys.exit(130)
+    finally:
+        executor.shutdown(wait=True)
+        shutdown_parse_pool()
+
+    logger.info(f"🏁 Готово за {time.perf_counter() - started:.1f} с, ошибок: {failed}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/fakes.py
+"""
+Подмены внешних сервисов для офлайн-бенчмарка: клиент arXiv и чат-модель.
+"""
+import asyncio
+import json
+import re
+import time
+from datetime import datetime
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from benchmarks.fixtures import paper_id
+
+
+class _Author:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class _Result:
+    def __init__(self, n: int):
+        self.entry_id = f"http://arxiv.org/abs/{paper_id(n)}v1"
+        self.title = f"Fixture paper {n}: efficient kv cache compression"
+        self.summary = "We study kv cache compression for long-context inference and report accuracy and memory."
+        self.published = datetime(2025, 1, 1 + n % 28)
+        self.authors = [_Author("A. Author"), _Author("B. Author")]
+
+
+class StubArxivClient:
+    """Вместо arxiv.Client: на любой запрос отдаёт первые max_results фикстурных статей."""
+
+    def __init__(self, corpus_size: int):
+        self.corpus_size = corpus_size
+
+    def results(self, search):
+        for n in range(min(search.max_results, self.corpus_size)):
+            yield _Result(n)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Детерминированная чат-модель с настраиваемой задержкой.
+    Отвечает по тем же промптам, что и узлы: гипотезы, оценка фрагмента, пакетная оценка.
+    """
+    latency: float = 0.0
+    model_name: str = "fake-chat-model"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _respond(self, messages) -> ChatResult:
+        prompt = messages[-1].content
+        if "JSON-массив" in prompt:
+            ids = [int(i) for i in re.findall(r"\[id=(\d+)\]", prompt)]
+            content = json.dumps([self._judgment(prompt, i) for i in ids])
+        elif "Фрагмент текста:" in prompt:
+            content = json.dumps(self._judgment(prompt))
+        else:
+            content = "\n".join([
+                "KV cache compression keeps accuracy with a 10% cache budget",
+                "Quantization of the kv cache reduces memory during inference",
+                "Attention-based token eviction improves throughput",
+            ])
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content, usage_metadata=usage))])
+
+    @staticmethod
+    def _judgment(prompt: str, chunk_id: int = None) -> dict:
+        confirmed = "accuracy" in prompt if chunk_id is None else chunk_id % 2 == 0
+        judgment = {"confirmed": confirmed, "partial": not confirmed, "confidence": 0.9 if confirmed else 0.4, "reason": "fake"}
+        if chunk_id is not None:
+            judgment["id"] = chunk_id
+        return judgment
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency)
+        return self._respond(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._respond(messages)
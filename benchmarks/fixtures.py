@@ -0,0 +1,98 @@
+# benchmarks/fixtures.py
+"""
+Локальные фикстуры для бенчмарка: детерминированные PDF «статьи» и HTTP-сервер,
+который раздаёт их вместо arxiv.org.
+"""
+import functools
+import http.server
+import os
+import random
+import threading
+
+VOCABULARY = (
+    "attention kv cache quantization layer embedding model inference memory throughput accuracy "
+    "latency token budget eviction compression baseline benchmark dataset experiment evaluation "
+    "method algorithm approach results table figure we propose show that our the of and in with"
+).split()
+
+SECTIONS = ["Abstract", "Introduction", "Method", "Experiments", "Results", "Conclusion"]
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: list) -> bytes:
+    """Минимальный PDF 1.4: одна страница — список строк, шрифт Helvetica. pypdf извлекает текст как есть."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{' '.join(f'{4 + 2 * i} 0 R' for i in range(len(pages)))}] /Count {len(pages)} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, lines in enumerate(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        content = ("BT /F1 9 Tf 11 TL 40 760 Td " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET").encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+
+def paper_id(n: int) -> str:
+    return f"2501.{n:05d}"
+
+
+def make_paper_pages(n: int, pages: int = 8, lines_per_page: int = 60) -> list:
+    """Текст статьи n: разделы, «результаты» с цифрами, детерминированный шум из VOCABULARY."""
+    rng = random.Random(n)
+    result = []
+    for p in range(pages):
+        lines = []
+        if p == 0:
+            lines += [f"Fixture paper {n}: efficient kv cache compression", "Abstract"]
+        for line_no in range(lines_per_page - len(lines)):
+            if line_no % 15 == 0:
+                lines.append(SECTIONS[(p + line_no // 15) % len(SECTIONS)])
+            elif line_no % 7 == 0:
+                lines.append(f"Table {p + 1}: {rng.randint(5, 95)}% cache gives {rng.randint(80, 105)}% accuracy.")
+            else:
+                lines.append(" ".join(rng.choice(VOCABULARY) for _ in range(14)) + ".")
+        result.append(lines)
+    return result
+
+
+def build_corpus(directory: str, size: int, pages: int = 8) -> list:
+    """Создаёт (если нет) PDF для статей 0..size-1 и возвращает их arXiv ID."""
+    os.makedirs(directory, exist_ok=True)
+    ids = []
+    for n in range(size):
+        path = os.path.join(directory, f"{paper_id(n)}.pdf")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(make_pdf(make_paper_pages(n, pages)))
+        ids.append(paper_id(n))
+    return ids
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_directory(directory: str):
+    """HTTP-сервер на свободном порту в фоновом потоке. Возвращает (server, base_url)."""
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, name="fixture-http", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -0,0 +1,135 @@
+# benchmarks/hybrid_recall.py
+"""
+Режим поиска hybrid против dense: полнота и сколько чанков не пришлось эмбеддить.
+
+    python -m benchmarks.hybrid_recall --pdf-dir cache/pdfs/blobs --candidates 20 50 100
+    python -m benchmarks.hybrid_recall --papers 100 --fake-embeddings   # фикстуры, без модели
+
+Чанки берутся из PDF в --pdf-dir, включая подпапки (например, кэша настоящих статей: файлы лежат
+в blobs/xx/<sha256>.pdf), или из фикстурных статей.
+Для каждого режима кэш эмбеддингов и индекс создаются заново во временной папке, поэтому
+число эмбеддингов честное. recall@k — доля чанков из top-k полного dense-поиска,
+которые нашёл hybrid.
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.fixtures import build_corpus
+
+QUERIES = [
+    "KV cache compression keeps accuracy with a small cache budget",
+    "Quantization of the kv cache reduces memory during inference",
+    "Attention-based token eviction improves throughput",
+    "Layer-wise cache sharing reduces memory footprint",
+    "Evaluation on long-context benchmarks shows minimal accuracy loss",
+]
+
+
+def load_chunks(paths: list) -> list:
+    from config import CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_SEPARATORS, PDF_MAX_PAGES
+    from utils.pdf_text import process_pdf
+
+    chunks = []
+    for path in paths:
+        result = process_pdf(path, os.path.basename(path), CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_SEPARATORS, PDF_MAX_PAGES)
+        if result["status"] == "ok":
+            chunks.extend(result["chunks"])
+    return chunks
+
+
+def run_mode(mode: str, hypotheses: list, chunks: list, k: int) -> dict:
+    """Один прогон retrieve_evidence на пустом кэше эмбеддингов."""
+    import nodes.retrieve_evidence as retrieve
+    from config import EMBEDDING_MODEL
+    from utils.embedding_cache import EmbeddingCache
+    from utils.vector_index import VectorIndex
+
+    retrieve.embedding_cache = EmbeddingCache(EMBEDDING_MODEL, root=tempfile.mkdtemp(prefix="bench-emb-"))
+    retrieve.vector_index = VectorIndex(retrieve.embedding_cache)
+    started = time.perf_counter()
+    update = retrieve.retrieve_evidence({
+        "hypotheses": hypotheses,
+        "chunks_with_metadata": chunks,
+        "retrieval_k": k,
+        "retrieval_filter": [],
+        "retrieval_mode": mode,
+    })
+    return {
+        "seconds": round(time.perf_counter() - started, 3),
+        "embedded_chunks": retrieve.embedding_cache.misses,
+        "found": [[chunk["text"] for chunk in item["chunks"]] for item in update["evidence"]],
+    }
+
+
+def recall(found: list, reference: list) -> float:
+    hits = total = 0
+    for mine, theirs in zip(found, reference):
+        hits += len(set(mine) & set(theirs))
+        total += len(set(theirs))
+    return hits / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hybrid (BM25 + dense) против dense")
+    parser.add_argument("--pdf-dir", help="папка с PDF (с подпапками); по умолчанию — фикстурные статьи")
+    parser.add_argument("--papers", type=int, default=50, help="фикстурных статей, если нет --pdf-dir")
+    parser.add_argument("--queries", help="файл с гипотезами, по одной на строку")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 50, 100], help="RETRIEVAL_CANDIDATES")
+    parser.add_argument("--fake-embeddings", action="store_true", help="DeterministicFakeEmbedding вместо модели")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from utils import resources
+    from utils.instrumentation import setup_logging
+    import nodes.retrieve_evidence as retrieve
+
+    setup_logging(os.environ["LOG_LEVEL"])
+    if args.fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        resources.override("embedding_model", DeterministicFakeEmbedding(size=1024))
+
+    if args.pdf_dir:
+        paths = sorted(glob.glob(os.path.join(args.pdf_dir, "**", "*.pdf"), recursive=True))
+    else:
+        directory = os.path.join(tempfile.gettempdir(), "research-assistant-fixtures")
+        build_corpus(directory, args.papers)
+        paths = sorted(glob.glob(os.path.join(directory, "*.pdf")))[:args.papers]
+    hypotheses = QUERIES
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            hypotheses = [line.strip() for line in f if line.strip()]
+
+    chunks = load_chunks(paths)
+    if not chunks:
+        raise SystemExit(f"❌ Нет чанков: найдено {len(paths)} PDF в {args.pdf_dir or 'фикстурах'}")
+    print(f"📚 {len(paths)} PDF, {len(chunks)} чанков, {len(hypotheses)} гипотез, k={args.k}")
+
+    dense = run_mode("dense", hypotheses, chunks, args.k)
+    rows = [{"mode": "dense", "candidates": None, "recall": 1.0,
+             "embedded_chunks": dense["embedded_chunks"], "seconds": dense["seconds"]}]
+    for n in args.candidates:
+        retrieve.RETRIEVAL_CANDIDATES = n
+        hybrid = run_mode("hybrid", hypotheses, chunks, args.k)
+        rows.append({
+            "mode": "hybrid", "candidates": n, "recall": round(recall(hybrid["found"], dense["found"]), 3),
+            "embedded_chunks": hybrid["embedded_chunks"], "seconds": hybrid["seconds"],
+        })
+
+    print(f"{'режим':>8} {'N':>5} {f'recall@{args.k}':>9} {'эмбеддингов':>12} {'экономия':>9} {'время, с':>9}")
+    for row in rows:
+        saved = 1 - row["embedded_chunks"] / dense["embedded_chunks"] if dense["embedded_chunks"] else 0.0
+        print(f"{row['mode']:>8} {row['candidates'] or '—':>5} {row['recall']:>9.3f} "
+              f"{row['embedded_chunks']:>12} {saved:>9.1%} {row['seconds']:>9.3f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"chunks": len(chunks), "k": args.k, "results": rows}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# benchmarks/index_backends.py
+"""
+Бэкенды векторного индекса: память, задержка поиска и recall@k относительно точного flat.
+
+    python -m benchmarks.index_backends --synthetic 200000 --dim 1024
+    python -m benchmarks.index_backends --from-cache --k 10 --nprobe 8 16 64
+    python -m benchmarks.index_backends --build ivfpq   # перестроить рабочий индекс из кэша эмбеддингов
+
+Индекс строится в текущем процессе, а открывается и ищется в отдельном свежем процессе (--measure):
+иначе в замер попадала бы память, оставшаяся от сборки. Память — приращение по /proc/self/status
+от открытия индекса до конца прогона запросов: RssAnon — частная память процесса (её платит каждый
+воркер), RssFile — страницы файла через mmap (общие для всех процессов).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+
+def _rss_mb() -> dict:
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "RssFile:")):
+                name, kb = line.split()[:2]
+                values[name.rstrip(":")] = int(kb) / 1024
+    return values
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Кластеризованные нормированные векторы — ближе к эмбеддингам текстов, чем равномерный шум."""
+    from utils.embedding_cache import normalize
+
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    return normalize(centers[labels] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32))
+
+
+def make_queries(vectors: np.ndarray, n: int, seed: int = 1) -> np.ndarray:
+    from utils.embedding_cache import normalize
+
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), size=min(n, len(vectors)), replace=False)
+    noise = 0.3 * rng.normal(size=(len(rows), vectors.shape[1])).astype(np.float32)
+    return normalize(vectors[rows] + noise)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    return index.search(queries, k)[1]
+
+
+def measure(backend: str, vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int,
+            nprobes: list, use_mmap: bool, workdir: str) -> list:
+    """Строит индекс один раз и меряет поиск для каждого nprobe (для flat и sq8 он ни на что не влияет)."""
+    from utils.vector_index import build_index
+
+    ids = np.arange(len(vectors), dtype=np.int64)
+    started = time.perf_counter()
+    index = build_index(backend, ids, lambda batch: vectors[batch], vectors.shape[1])
+    build_s = time.perf_counter() - started
+    path = os.path.join(workdir, f"{backend}.faiss")
+    faiss.write_index(index, path)
+    del index
+    np.save(os.path.join(workdir, "queries.npy"), queries)
+    np.save(os.path.join(workdir, "truth.npy"), truth)
+
+    command = [sys.executable, "-m", "benchmarks.index_backends", "--measure", path, "--k", str(k),
+               "--nprobe", *map(str, nprobes if backend == "ivfpq" else nprobes[:1])]
+    if not use_mmap:
+        command.append("--no-mmap")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(command, cwd=root, stdout=subprocess.PIPE, text=True, check=True).stdout
+    return [
+        {
+            "backend": backend,
+            "nprobe": row["nprobe"] if backend == "ivfpq" else None,
+            "file_mb": round(os.path.getsize(path) / 2**20, 1),
+            "build_s": round(build_s, 2),
+            **{key: value for key, value in row.items() if key != "nprobe"},
+        }
+        for row in json.loads(output.splitlines()[-1])
+    ]
+
+
+def measure_loaded(path: str, k: int, nprobes: list, use_mmap: bool) -> list:
+    """Выполняется в свежем процессе: открывает индекс, прогоняет запросы, меряет приращение RSS."""
+    from utils.vector_index import read_index, search_params
+
+    workdir = os.path.dirname(path)
+    queries = np.load(os.path.join(workdir, "queries.npy"))
+    truth = np.load(os.path.join(workdir, "truth.npy"))
+    before = _rss_mb()
+    index = read_index(path, mmap=use_mmap)
+    rows = []
+    for nprobe in nprobes:
+        params = search_params(index, nprobe=nprobe)
+        latencies = []
+        for query in queries:
+            t = time.perf_counter()
+            index.search(query[None, :], k, params=params)
+            latencies.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        found = index.search(queries, k, params=params)[1]
+        batch_s = time.perf_counter() - t
+        after = _rss_mb()
+
+        recall = np.mean([len(set(f) & set(e)) / k for f, e in zip(found.tolist(), truth.tolist())])
+        rows.append({
+            "nprobe": nprobe,
+            "rss_anon_mb": round(after.get("RssAnon", 0) - before.get("RssAnon", 0), 1),
+            "rss_file_mb": round(after.get("RssFile", 0) - before.get("RssFile", 0), 1),
+            "latency_ms_p50": round(float(np.median(latencies)) * 1000, 3),
+            "latency_ms_p95": round(float(np.percentile(latencies, 95)) * 1000, 3),
+            "batch_qps": round(len(queries) / batch_s, 1) if batch_s else None,
+            f"recall@{k}": round(float(recall), 4),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение бэкендов векторного индекса")
+    parser.add_argument("--from-cache", action="store_true", help="векторы из кэша эмбеддингов EMBEDDING_MODEL")
+    parser.add_argument("--synthetic", type=int, default=100000, help="число синтетических векторов")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--backends", nargs="+", default=["flat", "sq8", "ivfpq"])
+    parser.add_argument("--nprobe", type=int, nargs="+", help="значения nprobe для ivfpq (по умолчанию INDEX_NPROBE)")
+    parser.add_argument("--no-mmap", action="store_true", help="читать индекс в память, а не через mmap")
+    parser.add_argument("--build", choices=["flat", "sq8", "ivfpq"], help="перестроить рабочий индекс и выйти")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--measure", metavar="PATH", help=argparse.SUPPRESS)  # замер в дочернем процессе
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure_loaded(args.measure, args.k, args.nprobe, not args.no_mmap)))
+        return
+
+    from config import EMBEDDING_MODEL, INDEX_NPROBE
+    from utils.embedding_cache import EmbeddingCache
+    from utils.instrumentation import setup_logging
+    from utils.vector_index import VectorIndex
+
+    setup_logging()
+    if args.build:
+        started = time.perf_counter()
+        total = VectorIndex(EmbeddingCache(EMBEDDING_MODEL), backend=args.build).rebuild()
+        print(f"🏗️ Индекс {args.build}: {total} векторов за {time.perf_counter() - started:.1f} с")
+        return
+
+    if args.from_cache:
+        cache = EmbeddingCache(EMBEDDING_MODEL)
+        vectors = np.ascontiguousarray(cache.vectors(cache.ids()))
+    else:
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+    queries = make_queries(vectors, args.queries)
+    truth = exact_top_k(vectors, queries, args.k)
+    print(f"📐 {len(vectors)} векторов × {vectors.shape[1]}, {len(queries)} запросов, k={args.k}")
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="index-bench-") as workdir:
+        for backend in args.backends:
+            for row in measure(backend, vectors, queries, truth, args.k, args.nprobe or [INDEX_NPROBE],
+                               not args.no_mmap, workdir):
+                rows.append(row)
+                print(json.dumps(row, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"vectors": len(vectors), "dim": int(vectors.shape[1]), "k": args.k, "results": rows},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# benchmarks/run_benchmark.py
+"""
+Офлайн-бенчмарк пайплайна: скомпилированный graph.app на локальных фикстурных PDF,
+подменённом клиенте arXiv и детерминированной чат-модели с задержкой.
+
+    python -m benchmarks.run_benchmark --sizes 3 30 300 --output bench.json
+    python -m benchmarks.run_benchmark --baseline bench.json --tolerance 0.2
+
+Каждый размер корпуса прогоняется в отдельном процессе с пустыми кэшами (пиковый RSS —
+на размер). Первый прогон — «холодный», последний из --repeat — «тёплый» (все кэши заполнены).
+С --baseline сравнивает extract_text, retrieve_evidence и validate_evidence и завершается
+с кодом 1 при регрессии.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import build_corpus, serve_directory
+
+REGRESSION_NODES = ("extract_text", "retrieve_evidence", "validate_evidence")
+QUESTION = "How does kv cache compression keep accuracy with a small cache budget?"
+
+
+def _peak_rss_mb() -> dict:
+    # ru_maxrss в Linux — в килобайтах
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def _summarize(trace: dict, final_state: dict) -> dict:
+    papers = trace["nodes"].get("retrieve_papers", {}).get("papers", 0)
+    chunks = len(final_state.get("chunks_with_metadata", []))
+    return {
+        "total_s": trace["total_s"],
+        "nodes": {node: record["wall_s"] for node, record in trace["nodes"].items()},
+        "papers": papers,
+        "chunks": chunks,
+        "papers_per_s": round(papers / trace["total_s"], 3) if trace["total_s"] else None,
+        "chunks_per_s": round(chunks / trace["total_s"], 3) if trace["total_s"] else None,
+        "llm_calls": final_state.get("judge_stats", {}).get("llm_calls", 0),
+        "llm_calls_saved": final_state.get("judge_stats", {}).get("llm_calls_saved", 0),
+    }
+
+
+def run_single(size: int, args) -> dict:
+    """Один размер корпуса в текущем процессе. Окружение задаётся до импорта config."""
+    cache_dir = tempfile.mkdtemp(prefix="research-assistant-bench-")
+    server, base_url = serve_directory(args.fixtures)
+    os.environ.update({
+        "CACHE_DIR": cache_dir,
+        "ARXIV_PDF_BASE_URL": base_url,
+        "ARXIV_OFFLINE": "0",
+        "LOG_LEVEL": "WARNING",
+        "TRACE_FORMAT": "none",
+        "PREWARM_RESOURCES": "0",
+        "JUDGE_MODE": args.judge_mode,
+        "JUDGE_MIN_SCORE": str(args.judge_min_score),
+    })
+
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    import nodes.retrieve_papers
+    from benchmarks.fakes import FakeChatModel, StubArxivClient
+    from graph import app
+    from nodes.extract_text import shutdown_parse_pool
+    from state import initial_state
+    from utils import resources
+    from utils.instrumentation import invoke_traced, setup_logging
+
+    setup_logging("WARNING")
+    resources.override("llm", FakeChatModel(latency=args.llm_latency))
+    if not args.real_embeddings:
+        resources.override("embedding_model", DeterministicFakeEmbedding(size=1024))
+    nodes.retrieve_papers.client = StubArxivClient(size)
+
+    runs = []
+    for _ in range(args.repeat):
+        state = initial_state(QUESTION, max_papers=size)
+        final_state, trace = invoke_traced(app, state, config={"recursion_limit": 10})
+        runs.append(_summarize(trace, final_state))
+
+    shutdown_parse_pool()
+    server.shutdown()
+    result = {"size": size, "cold": runs[0], "peak_rss_mb": _peak_rss_mb()}
+    if len(runs) > 1:
+        result["warm"] = runs[-1]
+    return result
+
+
+def compare(current: dict, baseline: dict, tolerance: float, min_delta: float) -> list:
+    """Регрессии: узел стал медленнее базовой линии больше чем на tolerance (и на min_delta секунд)."""
+    baseline_by_size = {item["size"]: item for item in baseline["results"]}
+    regressions = []
+    for item in current["results"]:
+        base = baseline_by_size.get(item["size"])
+        if base is None:
+            continue
+        for run in ("cold", "warm"):
+            if run not in item or run not in base:
+                continue
+            for node in REGRESSION_NODES:
+                now, before = item[run]["nodes"].get(node), base[run]["nodes"].get(node)
+                if now is None or before is None:
+                    continue
+                if now > before * (1 + tolerance) and now - before > min_delta:
+                    regressions.append(
+                        f"{node} [{item['size']} статей, {run}]: {before:.3f} с → {now:.3f} с"
+                    )
+    return regressions
+
+
+def _print_table(results: list):
+    header = f"{'статей':>7} {'прогон':>6} {'всего, с':>9} " + " ".join(f"{node[:18]:>18}" for node in REGRESSION_NODES)
+    print(header + f" {'статей/с':>9} {'RSS, МБ':>8}")
+    for item in results:
+        for run in ("cold", "warm"):
+            if run not in item:
+                continue
+            data = item[run]
+            nodes = " ".join(f"{data['nodes'].get(node, 0):>18.3f}" for node in REGRESSION_NODES)
+            print(f"{item['size']:>7} {run:>6} {data['total_s']:>9.3f} {nodes} "
+                  f"{data['papers_per_s'] or 0:>9.2f} {item['peak_rss_mb']['self']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк research-assistant")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 30, 300], help="размеры корпуса (статей)")
+    parser.add_argument("--pages", type=int, default=8, help="страниц в фикстурной статье")
+    parser.add_argument("--repeat", type=int, default=2, help="прогонов на размер (первый — холодный)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="задержка фейковой LLM, с")
+    parser.add_argument("--judge-mode", default="per_chunk", choices=["per_chunk", "batched"])
+    # У фейковых эмбеддингов близость случайна — по умолчанию фильтр судьи выключен
+    parser.add_argument("--judge-min-score", type=float, default=0.0, help="JUDGE_MIN_SCORE для прогона")
+    parser.add_argument("--real-embeddings", action="store_true", help="настоящая модель эмбеддингов вместо фейковой")
+    parser.add_argument("--fixtures", default=os.path.join(tempfile.gettempdir(), "research-assistant-fixtures"))
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое замедление (доля)")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="игнорировать замедления меньше, с")
+    parser.add_argument("--single", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(run_single(args.single, args)))
+        return
+
+    build_corpus(args.fixtures, max(args.sizes), pages=args.pages)
+
+    results = []
+    for size in args.sizes:
+        print(f"▶️ Корпус: {size} статей...", flush=True)
+        command = [
+            sys.executable, "-m", "benchmarks.run_benchmark", "--single", str(size),
+            "--repeat", str(args.repeat), "--llm-latency", str(args.llm_latency),
+            "--judge-mode", args.judge_mode, "--judge-min-score", str(args.judge_min_score),
+            "--fixtures", args.fixtures,
+        ]
+        if args.real_embeddings:
+            command.append("--real-embeddings")
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(completed.stderr, file=sys.stderr)
+            sys.exit(completed.returncode)
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {
+            "pages": args.pages,
+            "repeat": args.repeat,
+            "llm_latency": args.llm_latency,
+            "judge_mode": args.judge_mode,
+            "judge_min_score": args.judge_min_score,
+            "real_embeddings": args.real_embeddings,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    _print_table(results)
+    print(f"💾 Результаты: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.min_delta)
+        if regressions:
+            print("❌ Регрессии относительно базовой линии:")
+            for line in regressions:
+                print(f"  • {line}")
+            sys.exit(1)
+        print("✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# config.py
+"""
+Настройки пайплайна. Любое значение можно переопределить через переменную окружения
+с тем же именем (например, PDF_DOWNLOAD_WORKERS=16 streamlit run app.py).
+"""
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_list(name: str, default: list) -> list:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+# === Загрузка и разбор PDF (nodes/extract_text.py) ===
+PDF_DOWNLOAD_WORKERS = _env_int("PDF_DOWNLOAD_WORKERS", 8)   # потоков на скачивание
+PDF_PER_HOST_LIMIT = _env_int("PDF_PER_HOST_LIMIT", 4)       # одновременных соединений к одному хосту
+PDF_PARSE_WORKERS = _env_int("PDF_PARSE_WORKERS", os.cpu_count() or 2)  # процессов pypdf; 0 — разбор в текущем процессе
+PDF_DOWNLOAD_TIMEOUT = _env_int("PDF_DOWNLOAD_TIMEOUT", 15)  # секунд на один запрос
+# Ограничения на одну статью: память на статью не растёт вместе с размером PDF
+PDF_MAX_BYTES = _env_int("PDF_MAX_BYTES", 50 * 1024 * 1024)  # больше — не скачиваем
+PDF_MAX_PAGES = _env_int("PDF_MAX_PAGES", 60)                # 0 — без ограничения
+
+# === Кэши на диске ===
+# По умолчанию — рядом с кодом, а не в текущем каталоге: app.py, server.py и batch.py делят один кэш
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+# Кэш скачанных PDF (utils/cache.py): файлы по SHA-256 содержимого, LRU-вытеснение сверх лимита
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(CACHE_DIR, "pdfs"))
+PDF_CACHE_MAX_BYTES = _env_int("PDF_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024)  # 0 — без лимита
+
+# === Chunking и хранилище чанков (utils/chunk_store.py) ===
+CHUNK_SIZE = _env_int("CHUNK_SIZE", 1000)
+CHUNK_OVERLAP = _env_int("CHUNK_OVERLAP", 100)
+CHUNK_SEPARATORS = ["\n\n", "\n", ".", " ", ""]
+CHUNK_STORE_PATH = os.getenv("CHUNK_STORE_PATH", os.path.join(CACHE_DIR, "chunks.sqlite"))
+CHUNK_STORE_MAX_BYTES = _env_int("CHUNK_STORE_MAX_BYTES", 512 * 1024 * 1024)
+
+# === Эмбеддинги и векторный индекс (nodes/retrieve_evidence.py) ===
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-large-en-v1.5")
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(CACHE_DIR, "embeddings"))
+# Эмбеддить чанки каждой статьи сразу после её разбора, пока остальные ещё скачиваются
+STREAMING_EMBED = os.getenv("STREAMING_EMBED", "1") not in ("0", "false", "False")
+
+# === Векторный индекс (utils/vector_index.py) ===
+# flat — точный float32; sq8 — int8, в 4 раза меньше; ivfpq — IVF + PQ, в десятки раз меньше, приближённый
+INDEX_BACKEND = os.getenv("INDEX_BACKEND", "flat")
+INDEX_TRAIN_MIN = _env_int("INDEX_TRAIN_MIN", 20000)        # до стольких векторов квантованный индекс не строится
+INDEX_TRAIN_SAMPLE = _env_int("INDEX_TRAIN_SAMPLE", 100000)  # векторов в выборке для обучения
+INDEX_NLIST = _env_int("INDEX_NLIST", 0)                    # кластеров IVF; 0 — 4·√N
+INDEX_PQ_M = _env_int("INDEX_PQ_M", 64)                     # подпространств PQ (байт на вектор)
+INDEX_NPROBE = _env_int("INDEX_NPROBE", 16)                 # просматриваемых кластеров IVF при поиске
+# Открывать сегменты индекса через mmap только для чтения (общий page cache для всех процессов)
+INDEX_MMAP = os.getenv("INDEX_MMAP", "1") not in ("0", "false", "False")
+# Новые векторы ищутся точно по кэшу эмбеддингов, пока их не наберётся столько — тогда фоновый
+# поток дописывает их в индекс отдельным сегментом (без перечитывания и переобучения индекса)
+INDEX_MERGE_TAIL = _env_int("INDEX_MERGE_TAIL", 20000)
+# Обучать первый квантованный индекс в фоне, когда векторов >= INDEX_TRAIN_MIN; 0 — только офлайн (--build)
+INDEX_AUTO_BUILD = os.getenv("INDEX_AUTO_BUILD", "1") not in ("0", "false", "False")
+
+# === Поиск доказательств ===
+RETRIEVAL_K = _env_int("RETRIEVAL_K", 3)  # чанков на гипотезу
+# Флаги метаданных из extract_text: чанк проходит фильтр, если у него есть хотя бы один из них.
+# Пустой список — без фильтра. Можно переопределить на запрос через state["retrieval_filter"].
+RETRIEVAL_FILTER = _env_list("RETRIEVAL_FILTER", ["contains_results", "contains_experiment"])
+# dense — эмбеддинги всех чанков и FAISS; hybrid — BM25 выбирает кандидатов, эмбеддятся только они
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+RETRIEVAL_CANDIDATES = _env_int("RETRIEVAL_CANDIDATES", 50)            # кандидатов BM25 на гипотезу
+RETRIEVAL_HYBRID_ALPHA = _env_float("RETRIEVAL_HYBRID_ALPHA", 0.7)     # вес косинуса в итоговой оценке
+
+# === LLM (utils/resources.py) ===
+LLM_MODEL = os.getenv("LLM_MODEL", "google/gemini-2.0-flash-001")
+LLM_TIMEOUT = _env_int("LLM_TIMEOUT", 30)  # секунд на запрос
+# Загружать модель эмбеддингов и LLM-клиент в фоне сразу при старте приложения
+PREWARM_RESOURCES = os.getenv("PREWARM_RESOURCES", "1") not in ("0", "false", "False")
+
+# === LLM-судья (nodes/validate_evidence.py) ===
+JUDGE_MAX_CONCURRENCY = _env_int("JUDGE_MAX_CONCURRENCY", 8)          # одновременных запросов к LLM
+LLM_REQUESTS_PER_SECOND = _env_float("LLM_REQUESTS_PER_SECOND", 5.0)  # token bucket для OpenRouter
+LLM_MAX_RETRIES = _env_int("LLM_MAX_RETRIES", 3)                      # повторы на 429 / 5xx / таймаут
+# "per_chunk" — отдельный запрос на каждую пару (гипотеза, чанк);
+# "batched" — один запрос на гипотезу со всеми её чанками (откат на per_chunk при битом ответе)
+JUDGE_MODE = os.getenv("JUDGE_MODE", "per_chunk")
+# Каскад: чанки с косинусной близостью ниже порога отклоняются без запроса к LLM (0 — проверять все)
+JUDGE_MIN_SCORE = _env_float("JUDGE_MIN_SCORE", 0.45)
+# per_chunk: чанки проверяются по убыванию близости волнами по JUDGE_WAVE_SIZE на гипотезу;
+# гипотеза закрывается после JUDGE_STOP_CONFIRMATIONS подтверждений с уверенностью
+# не ниже JUDGE_STOP_CONFIDENCE (0 — без ранней остановки). Каждая волна — ещё один раунд запросов,
+# поэтому по умолчанию волна — все k чанков гипотезы (0): одна волна, ранняя остановка выключена;
+# JUDGE_WAVE_SIZE < retrieval_k меняет задержку на экономию запросов
+JUDGE_STOP_CONFIRMATIONS = _env_int("JUDGE_STOP_CONFIRMATIONS", 2)
+JUDGE_STOP_CONFIDENCE = _env_float("JUDGE_STOP_CONFIDENCE", 0.8)
+JUDGE_WAVE_SIZE = _env_int("JUDGE_WAVE_SIZE", 0)
+
+# === Кэш ответов LLM (utils/llm_cache.py) ===
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") not in ("0", "false", "False")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(CACHE_DIR, "llm.sqlite"))
+LLM_CACHE_TTL = _env_int("LLM_CACHE_TTL", 7 * 24 * 3600)                 # секунд
+LLM_CACHE_MAX_BYTES = _env_int("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+
+# === Поиск статей arXiv (nodes/retrieve_papers.py, utils/arxiv_cache.py) ===
+ARXIV_MAX_RESULTS = _env_int("ARXIV_MAX_RESULTS", 3)
+ARXIV_PDF_BASE_URL = os.getenv("ARXIV_PDF_BASE_URL", "https://arxiv.org/pdf")  # зеркало или локальные фикстуры
+ARXIV_CACHE_PATH = os.getenv("ARXIV_CACHE_PATH", os.path.join(CACHE_DIR, "arxiv.sqlite"))
+ARXIV_CACHE_TTL = _env_int("ARXIV_CACHE_TTL", 24 * 3600)  # секунд до повторного запроса к arXiv
+# Офлайн-режим: отвечаем только из локального кэша, без обращений к arXiv
+ARXIV_OFFLINE = os.getenv("ARXIV_OFFLINE", "0") not in ("0", "false", "False")
+
+# === Пакетный режим (batch.py) ===
+BATCH_WORKERS = _env_int("BATCH_WORKERS", 4)  # вопросов одновременно
+
+# === HTTP-сервис (server.py) ===
+SERVICE_MAX_CONCURRENT = _env_int("SERVICE_MAX_CONCURRENT", 4)  # прогонов графа одновременно
+SERVICE_MAX_QUEUE = _env_int("SERVICE_MAX_QUEUE", 32)           # ждущих в очереди; сверх — 503
+SERVICE_QUEUE_TIMEOUT = _env_int("SERVICE_QUEUE_TIMEOUT", 120)  # секунд ожидания места в очереди
+
+# === Логи и трейсы (utils/instrumentation.py) ===
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # DEBUG / INFO / WARNING / ERROR / OFF
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "jsonl")  # jsonl / prometheus / none
+TRACE_PATH = os.getenv(
+    "TRACE_PATH",
+    os.path.join(CACHE_DIR, "traces.prom" if TRACE_FORMAT == "prometheus" else "traces.jsonl")
+)
@@ -1,6 +1,9 @@
 # graph.py
-from langgraph.graph import StateGraph, END
+import logging
+
+from langgraph.graph import StateGraph, START, END
 from state import GraphState
+from utils.instrumentation import instrument
 
 # Импортируем заглушки узлов
 from nodes.retrieve_papers import retrieve_papers
@@ -10,6 +13,8 @@ from nodes.retrieve_evidence import retrieve_evidence
 from nodes.validate_evidence import validate_evidence
 from nodes.synthesize_answer import synthesize_answer
 
+logger = logging.getLogger(__name__)
+
 # === Определяем условный переход ===
 def should_retry(state):
     """
@@ -20,29 +25,35 @@ def should_retry(state):
     confirmed = [e for e in evidence if e.get("judgment", {}).get("confirmed", False)]
     
     if len(confirmed) < 2 and state.get("retry_count", 0) < 1:
-        print("🔄 Мало подтверждённых гипотез — повторный поиск")
+        logger.info("🔄 Мало подтверждённых гипотез — повторный поиск")
         return "retrieve_papers"
     else:
-        print("✅ Достаточно доказательств — завершаем")
+        logger.info("✅ Достаточно доказательств — завершаем")
         return "synthesize_answer"
 
 # === Создаём граф ===
 workflow = StateGraph(GraphState)
 
-# Добавляем узлы
-workflow.add_node("retrieve_papers", retrieve_papers)
-workflow.add_node("extract_text", extract_text)
-workflow.add_node("generate_hypotheses", generate_hypotheses)
-workflow.add_node("retrieve_evidence", retrieve_evidence)
-workflow.add_node("validate_evidence", validate_evidence)
-workflow.add_node("synthesize_answer", synthesize_answer)
+# Добавляем узлы (каждый обёрнут в instrument: время и счётчики → state["metrics"])
+workflow.add_node("retrieve_papers", instrument("retrieve_papers", retrieve_papers))
+workflow.add_node("extract_text", instrument("extract_text", extract_text))
+workflow.add_node("generate_hypotheses", instrument("generate_hypotheses", generate_hypotheses))
+workflow.add_node("retrieve_evidence", instrument("retrieve_evidence", retrieve_evidence))
+workflow.add_node("validate_evidence", instrument("validate_evidence", validate_evidence))
+workflow.add_node("synthesize_answer", instrument("synthesize_answer", synthesize_answer))
 
 # === Задаём переходы ===
-workflow.set_entry_point("retrieve_papers")
+# Гипотезам нужен только вопрос, поэтому они генерируются параллельно
+# с поиском статей и извлечением текста:
+#
+#   START ─┬─ retrieve_papers ── extract_text ─┬─ retrieve_evidence ── validate_evidence ── synthesize_answer
+#          └─ generate_hypotheses ─────────────┘
+workflow.add_edge(START, "retrieve_papers")
+workflow.add_edge(START, "generate_hypotheses")
 
 workflow.add_edge("retrieve_papers", "extract_text")
-workflow.add_edge("extract_text", "generate_hypotheses")
-workflow.add_edge("generate_hypotheses", "retrieve_evidence")
+# retrieve_evidence ждёт обе ветки
+workflow.add_edge(["extract_text", "generate_hypotheses"], "retrieve_evidence")
 workflow.add_edge("retrieve_evidence", "validate_evidence")
 
 # # Условный переход: повтор или завершение
@@ -1,76 +1,236 @@
 # nodes/extract_text.py
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlparse
+
 import requests
-from pypdf import PdfReader
-import io
-import re
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from requests.adapters import HTTPAdapter
+
+from config import (
+    PDF_DOWNLOAD_WORKERS, PDF_PER_HOST_LIMIT, PDF_PARSE_WORKERS, PDF_DOWNLOAD_TIMEOUT,
+    PDF_MAX_BYTES, PDF_MAX_PAGES, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_SEPARATORS, STREAMING_EMBED, RETRIEVAL_MODE
+)
+from utils.cache import download_pdf_cached, pdf_cache
+from utils.chunk_store import chunk_store, settings_hash
+from utils.instrumentation import submit
+from utils.pdf_text import process_pdf, PIPELINE_VERSION
+from utils.singleflight import SingleFlight
+from nodes.retrieve_evidence import index_chunks
+
+logger = logging.getLogger(__name__)
+
+# Лимит страниц тоже меняет чанки, поэтому входит в ключ хранилища
+CHUNK_SETTINGS = settings_hash(CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_SEPARATORS, f"{PIPELINE_VERSION}:{PDF_MAX_PAGES}")
+
+# Общие для всех вызовов ресурсы: пул соединений, семафоры по хостам, пул процессов pypdf
+_lock = threading.Lock()
+_session = None
+_host_limits = {}
+_parse_pool = None
+# Параллельные запросы (пакетный режим) скачивают и разбирают одну статью один раз
+_downloads = SingleFlight("pdf_download")
+_parses = SingleFlight("pdf_parse")
+
+
+def _get_session() -> requests.Session:
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=PDF_DOWNLOAD_WORKERS, pool_maxsize=PDF_DOWNLOAD_WORKERS)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def _host_limit(url: str) -> threading.Semaphore:
+    host = urlparse(url).netloc
+    with _lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(PDF_PER_HOST_LIMIT)
+        return _host_limits[host]
+
+
+def _get_parse_pool():
+    """Пул процессов создаётся один раз и переиспользуется между запросами."""
+    global _parse_pool
+    if PDF_PARSE_WORKERS <= 0:
+        return None
+    with _lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=PDF_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _parse_pool
+
+
+def _reset_parse_pool(broken):
+    """Сбрасывает упавший пул — только если он всё ещё текущий: новый пул мог уже создать другой запрос."""
+    global _parse_pool
+    with _lock:
+        if broken is None or _parse_pool is not broken:
+            return
+        _parse_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_parse_pool():
+    """Останавливает пул процессов pypdf и ждёт его завершения (CLI, бенчмарки)."""
+    global _parse_pool
+    with _lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=True)
+        _parse_pool = None
+
+
+def _download(pdf_url: str):
+    with _host_limit(pdf_url):
+        return download_pdf_cached(
+            pdf_url, timeout=PDF_DOWNLOAD_TIMEOUT, session=_get_session(), max_bytes=PDF_MAX_BYTES
+        )
+
+
+def _download_once(pdf_url: str):
+    return _downloads.do(pdf_url, _download, pdf_url)
+
+
+def _submit_parse(executor, args: tuple) -> Future:
+    """executor.submit(process_pdf); BrokenProcessPool помечается пулом, в котором случился."""
+    try:
+        future = executor.submit(process_pdf, *args)
+    except BrokenProcessPool as e:
+        e.pool = executor
+        future = Future()
+        future.set_exception(e)
+        return future
+
+    def _remember_pool(finished: Future):
+        error = None if finished.cancelled() else finished.exception()
+        if isinstance(error, BrokenProcessPool):
+            error.pool = executor
+
+    future.add_done_callback(_remember_pool)
+    return future
+
+
+def _start_parse(path, title: str, executor) -> Future:
+    args = (str(path), title, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_SEPARATORS, PDF_MAX_PAGES)
+    return _parses.future(str(path), lambda: _submit_parse(executor, args))
+
+
+def _embed_paper(result: dict, embedder: ThreadPoolExecutor, pending: list):
+    """Потоковый режим: чанки готовой статьи сразу уходят в эмбеддинг, не дожидаясь остальных."""
+    if embedder is not None and result["status"] == "ok" and result["chunks"]:
+        pending.append(submit(embedder, index_chunks, [chunk["text"] for chunk in result["chunks"]]))
+
+
+def _collect_parses(parses: dict, results: list, embedder, pending: list) -> list:
+    """Собирает результаты разбора. Возвращает статьи, чей разбор оборвало падение пула процессов."""
+    broken = []
+    for future in as_completed(parses):
+        i, paper, path = parses[future]
+        try:
+            results[i] = future.result()
+            if paper.get("arxiv_id"):
+                chunk_store.put(paper["arxiv_id"], CHUNK_SETTINGS, results[i])
+            _embed_paper(results[i], embedder, pending)
+        except BrokenProcessPool as e:
+            _reset_parse_pool(getattr(e, "pool", None))
+            broken.append((i, paper, path))
+        except Exception as e:
+            logger.error(f"❌ Ошибка при обработке {paper['pdf_url']}: {e}")
+    return broken
+
 
 def extract_text(state):
     """
     Узел 2: Извлекает текст из PDF и разбивает на чанки с метаданными.
+    Скачивание идёт параллельно в потоках (через дисковый кэш), разбор pypdf — в пуле процессов:
+    статья уходит в разбор сразу, как только скачана. Порядок чанков совпадает с порядком статей.
+    Уже разобранные статьи (по arXiv ID и настройкам chunking) берутся из хранилища чанков.
+    При STREAMING_EMBED чанки каждой статьи эмбеддятся, пока остальные ещё скачиваются
+    (кроме режима поиска hybrid: там эмбеддятся только кандидаты BM25).
+    Одновременные вызовы из разных потоков не скачивают и не разбирают одну статью дважды.
+    Если пул процессов упал, статьи из него один раз разбираются заново в новом пуле.
     """
-    print("📄 Узел: Извлечение текста из PDF + chunking с метаданными...")
-    
+    logger.info("📄 Узел: Извлечение текста из PDF + chunking с метаданными...")
+
     papers = state.get("papers", [])
     if not papers:
-        print("⚠️ Нет статей для извлечения.")
-        return {"retrieved_texts": []}
-    
-    all_chunks_with_metadata = []
+        logger.warning("⚠️ Нет статей для извлечения.")
+        return {"chunks_with_metadata": []}
+
+    results = [None] * len(papers)
+    jobs = []
+    # Один поток на эмбеддинги: модель всё равно занимает все ядра
+    streaming = STREAMING_EMBED and (state.get("retrieval_mode") or RETRIEVAL_MODE) == "dense"
+    embedder = ThreadPoolExecutor(max_workers=1) if streaming else None
+    pending_embeddings = []
     for i, paper in enumerate(papers):
-        pdf_url = paper.get("pdf_url")
-        if not pdf_url:
+        if not paper.get("pdf_url"):
             continue
+        stored = chunk_store.get(paper["arxiv_id"], CHUNK_SETTINGS) if paper.get("arxiv_id") else None
+        if stored is not None:
+            logger.info(f"📦 Из хранилища чанков [{i+1}/{len(papers)}]: {paper['arxiv_id']}")
+            results[i] = stored
+            _embed_paper(stored, embedder, pending_embeddings)
+        else:
+            jobs.append((i, paper))
+    parse_pool = _get_parse_pool()
 
-        print(f"📥 Скачиваем PDF [{i+1}/{len(papers)}]: {pdf_url}")
-        try:
-            response = requests.get(pdf_url, timeout=15)
-            response.raise_for_status()
-
-            pdf = PdfReader(io.BytesIO(response.content))
-            full_text = ""
-            for page in pdf.pages:
-                full_text += page.extract_text() + "\n"
-            
-            # 🔍 Проверяем, что это реальная статья
-            clean_text = re.sub(r'\s+', ' ', full_text).strip()
-            structure_keywords = ["abstract", "introduction", "method", "experiment", "results", "conclusion"]
-            if not any(kw in clean_text.lower()[:1000] for kw in structure_keywords):
-                print("⚠️ Пропускаем: нет структуры научной статьи")
-                continue
+    with ThreadPoolExecutor(max_workers=PDF_DOWNLOAD_WORKERS) as downloader:
+        downloads = {submit(downloader, _download_once, paper["pdf_url"]): (i, paper) for i, paper in jobs}
+        for i, paper in jobs:
+            logger.info(f"📥 Скачиваем PDF [{i+1}/{len(papers)}]: {paper['pdf_url']}")
 
-            tech_terms = ["attention", "kv cache", "quantization", "layer", "embedding", "model", "inference"]
-            if not any(term in clean_text.lower() for term in tech_terms):
-                print("⚠️ Пропускаем: нет технического содержания")
+        parses = {}
+        for future in as_completed(downloads):
+            i, paper = downloads[future]
+            try:
+                path = future.result()
+            except Exception as e:
+                logger.error(f"❌ Ошибка при обработке {paper['pdf_url']}: {e}")
                 continue
 
-            # 🔥 Разбиваем на чанки с метаданными
-            splitter = RecursiveCharacterTextSplitter(
-                separators=["\n\n", "\n", ".", " ", ""],
-                chunk_size=1000,
-                chunk_overlap=100
-            )
-            chunks = splitter.split_text(full_text)
-
-            # Добавляем метаданные к каждому чанку
-            for chunk in chunks:
-                metadata = {
-                    "source_title": paper["title"],
-                    "contains_method": any(kw in chunk.lower() for kw in ["method", "algorithm", "approach"]),
-                    "contains_results": any(kw in chunk.lower() for kw in ["result", "accuracy", "throughput", "memory", "table", "figure"]),
-                    "contains_experiment": any(kw in chunk.lower() for kw in ["experiment", "benchmark", "evaluation", "dataset"]),
-                    "contains_figures": "figure" in chunk.lower() or "table" in chunk.lower(),
-                    "page_estimate": len(full_text[:full_text.find(chunk)]) // 2000  # грубая оценка страницы
-                }
-                all_chunks_with_metadata.append({
-                    "text": chunk,
-                    "metadata": metadata
-                })
-
-            print(f"✅ Разбито на {len(chunks)} чанков")
-        
-        except Exception as e:
-            print(f"❌ Ошибка при обработке {pdf_url}: {e}")
-    
-    print(f"✅ Всего чанков с метаданными: {len(all_chunks_with_metadata)}")
-    return {"chunks_with_metadata": all_chunks_with_metadata}
\ No newline at end of file
+            executor = downloader if parse_pool is None else parse_pool
+            parses[_start_parse(path, paper["title"], executor)] = (i, paper, path)
+
+        broken = _collect_parses(parses, results, embedder, pending_embeddings)
+        if broken:
+            logger.warning(f"⚠️ Пул разбора PDF упал — повторяем {len(broken)} статей в новом пуле")
+            parse_pool = _get_parse_pool()
+            retried = {_start_parse(path, paper["title"], parse_pool): (i, paper, path) for i, paper, path in broken}
+            for i, paper, path in _collect_parses(retried, results, embedder, pending_embeddings):
+                logger.error(f"❌ Ошибка при обработке {paper['pdf_url']}: пул процессов упал при повторном разборе")
+
+    if embedder is not None:
+        # retrieve_evidence затем найдёт все эмбеддинги в кэше
+        for future in pending_embeddings:
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning(f"⚠️ Потоковый эмбеддинг не удался (повторим в поиске доказательств): {e}")
+        embedder.shutdown()
+
+    all_chunks_with_metadata = []
+    for result in results:
+        if result is None:
+            continue
+        if result["status"] == "no_structure":
+            logger.warning("⚠️ Пропускаем: нет структуры научной статьи")
+            continue
+        if result["status"] == "no_tech":
+            logger.warning("⚠️ Пропускаем: нет технического содержания")
+            continue
+
+        all_chunks_with_metadata.extend(result["chunks"])
+        logger.info(f"✅ Разбито на {len(result['chunks'])} чанков")
+
+    logger.info(f"✅ Всего чанков с метаданными: {len(all_chunks_with_metadata)}")
+    logger.info(f"📦 Хранилище чанков: {chunk_store.stats()}")
+    logger.info(f"🗄️ Кэш PDF: {pdf_cache.stats()}")
+    return {"chunks_with_metadata": all_chunks_with_metadata}
@@ -1,44 +1,175 @@
 # nodes/retrieve_evidence.py
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import logging
+
+import numpy as np
+
+from config import (
+    EMBEDDING_MODEL, RETRIEVAL_K, RETRIEVAL_FILTER, RETRIEVAL_MODE, RETRIEVAL_CANDIDATES, RETRIEVAL_HYBRID_ALPHA
+)
+from utils import resources
+from utils.bm25 import BM25Index, top_n
+from utils.embedding_cache import EmbeddingCache, normalize
+from utils.instrumentation import count
+from utils.vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+# Кэш эмбеддингов и FAISS-индекс живут между запросами и процессами
+embedding_cache = EmbeddingCache(EMBEDDING_MODEL)
+vector_index = VectorIndex(embedding_cache)
+
+# Булевы флаги метаданных, по которым можно фильтровать (ставит extract_text)
+FILTER_FLAGS = ["contains_method", "contains_results", "contains_experiment", "contains_figures"]
+
+RETRIEVAL_MODES = ["dense", "hybrid"]
+
+
+def _filter_mask(chunks_data: list, filter_flags: list) -> np.ndarray:
+    """Маска чанков, у которых есть хотя бы один из флагов filter_flags."""
+    flags = np.array(
+        [[bool(chunk["metadata"].get(flag)) for flag in FILTER_FLAGS] for chunk in chunks_data],
+        dtype=bool
+    ).reshape(len(chunks_data), len(FILTER_FLAGS))
+    columns = [FILTER_FLAGS.index(flag) for flag in filter_flags]
+    return flags[:, columns].any(axis=1)
+
+
+def index_chunks(texts: list) -> np.ndarray:
+    """
+    Эмбеддинги чанков через кэш: новые векторы сразу доступны для поиска,
+    сжатый индекс догоняет кэш в фоне. Возвращает ID чанков.
+    """
+    embedding_model = resources.get("embedding_model")
+    chunk_ids = embedding_cache.embed(texts, embedding_model.embed_documents)
+    vector_index.sync()
+    return chunk_ids
+
+
+def _dense_search(queries: np.ndarray, chunks_data: list, mask, k: int) -> list:
+    """Все чанки через кэш эмбеддингов и FAISS. Для каждой гипотезы — [(позиция чанка, оценки)]."""
+    texts = [chunk["text"] for chunk in chunks_data]
+    chunk_ids = index_chunks(texts)
+    logger.info(f"🗂️ Индекс: {vector_index.stats()}; кэш эмбеддингов: {embedding_cache.stats()}")
+
+    # ID → первый чанк с таким текстом
+    position = {}
+    for i, chunk_id in enumerate(chunk_ids.tolist()):
+        position.setdefault(chunk_id, i)
+
+    candidate_ids = chunk_ids if mask is None else chunk_ids[mask]
+    scores, ids = vector_index.search(queries, k=k, subset=candidate_ids)
+    return [
+        [(position[int(chunk_id)], {"score": float(score)}) for score, chunk_id in zip(scores[row], ids[row]) if chunk_id >= 0]
+        for row in range(len(queries))
+    ]
+
+
+def _hybrid_search(hypotheses: list, queries: np.ndarray, chunks_data: list, mask, k: int, n_candidates: int):
+    """
+    BM25 по всем чанкам выбирает до n_candidates на гипотезу; эмбеддятся (через кэш) только
+    кандидаты, итоговая оценка — alpha * косинус + (1 - alpha) * BM25 / max BM25 гипотезы.
+    None — ни у одной гипотезы нет общих терминов с чанками.
+    """
+    texts = [chunk["text"] for chunk in chunks_data]
+    bm25 = BM25Index(texts)
+    lexical = np.stack([bm25.scores(hypothesis) for hypothesis in hypotheses])
+    if mask is not None:
+        lexical[:, ~mask] = 0
+    candidates = np.unique(np.concatenate([top_n(row, n_candidates) for row in lexical]))
+    if len(candidates) == 0:
+        return None
+    count("bm25_candidates", len(candidates))
+    logger.info(f"🔤 BM25: {len(candidates)} кандидатов из {len(chunks_data)} чанков")
+
+    chunk_ids = index_chunks([texts[i] for i in candidates])
+    dense = queries @ embedding_cache.vectors(chunk_ids).T
+    lexical = lexical[:, candidates]
+    top = lexical.max(axis=1, keepdims=True)
+    top[top == 0] = 1.0
+    fused = RETRIEVAL_HYBRID_ALPHA * dense + (1 - RETRIEVAL_HYBRID_ALPHA) * lexical / top
+
+    results = []
+    for row in range(len(hypotheses)):
+        order = np.argsort(-fused[row], kind="stable")[:k]
+        results.append([
+            (int(candidates[j]), {
+                "score": float(dense[row, j]),
+                "bm25_score": float(lexical[row, j]),
+                "fused_score": float(fused[row, j])
+            })
+            for j in order
+        ])
+    return results
 
-embedding_model = HuggingFaceEmbeddings(model_name="BAAI/bge-large-en-v1.5")
 
 def retrieve_evidence(state):
     """
     Узел 4: Для каждой гипотезы находит релевантные чанки через векторный поиск.
-    Использует метаданные для фильтрации (например, только где есть "results").
+    Использует метаданные для фильтрации (например, только где есть "results"):
+    фильтр применяется до поиска через IDSelector, а не после.
+    Все гипотезы эмбеддятся одним батчем и ищутся одним матричным запросом к FAISS.
+    Через модель проходят только чанки, которых ещё нет в кэше эмбеддингов;
+    поиск идёт в общем индексе, но только среди чанков текущих статей.
+    В режиме hybrid кандидатов сначала отбирает BM25, и эмбеддятся только они.
+    "score" у найденного чанка — всегда косинусная близость к гипотезе.
+
+    Параметры запроса (необязательные): state["retrieval_k"], state["retrieval_filter"],
+    state["retrieval_mode"].
     """
-    print("🔎 Узел: Поиск доказательств (с фильтрацией по метаданным)...")
+    logger.info("🔎 Узел: Поиск доказательств (с фильтрацией по метаданным)...")
     
     hypotheses = state.get("hypotheses", [])
     chunks_data = state.get("chunks_with_metadata", [])
     
     if not hypotheses or not chunks_data:
-        print("⚠️ Нет гипотез или чанков для поиска.")
+        logger.warning("⚠️ Нет гипотез или чанков для поиска.")
         return {"evidence": []}
 
-    # Создаём векторное хранилище
-    texts = [chunk["text"] for chunk in chunks_data]
-    metadatas = [chunk["metadata"] for chunk in chunks_data]
+    # 🔥 Фильтруем: ищем только в чанках с "results" или "experiment" (по умолчанию)
+    k = state.get("retrieval_k") or RETRIEVAL_K
+    filter_flags = state.get("retrieval_filter")
+    if filter_flags is None:
+        filter_flags = RETRIEVAL_FILTER
+    unknown = [flag for flag in filter_flags if flag not in FILTER_FLAGS]
+    if unknown:
+        logger.warning(f"⚠️ Неизвестные флаги фильтра пропущены: {unknown}")
+        filter_flags = [flag for flag in filter_flags if flag in FILTER_FLAGS]
+
+    mask = None
+    if filter_flags:
+        mask = _filter_mask(chunks_data, filter_flags)
+        if mask.any():
+            logger.info(f"🧹 Фильтр {filter_flags}: {int(mask.sum())} из {len(chunks_data)} чанков")
+        else:
+            logger.warning(f"⚠️ Ни один чанк не прошёл фильтр {filter_flags} — ищем по всем")
+            mask = None
+
+    mode = state.get("retrieval_mode") or RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        logger.warning(f"⚠️ Неизвестный режим поиска '{mode}' — используем dense")
+        mode = "dense"
+
+    # Все гипотезы — одним батчем
+    queries = normalize(resources.get("embedding_model").embed_documents(hypotheses))
+    found = None
+    if mode == "hybrid":
+        found = _hybrid_search(hypotheses, queries, chunks_data, mask, k, RETRIEVAL_CANDIDATES)
+        if found is None:
+            logger.warning("⚠️ BM25 не нашёл общих терминов — ищем по всем чанкам")
+    if found is None:
+        found = _dense_search(queries, chunks_data, mask, k)
 
-    vectorstore = FAISS.from_texts(texts=texts, embedding=embedding_model, metadatas=metadatas)
-    
     evidence = []
-    for hypothesis in hypotheses:
-        print(f"🔍 Поиск по гипотезе: '{hypothesis[:60]}...'")
-
-        # 🔥 Фильтруем: ищем только в чанках с "results" или "experiment"
-        docs = vectorstore.similarity_search(
-            hypothesis,
-            k=3
-        )
-        
+    for hypothesis, matches in zip(hypotheses, found):
+        logger.info(f"🔍 Поиск по гипотезе: '{hypothesis[:60]}...'")
+
         found_chunks = []
-        for doc in docs:
+        for i, scores in matches:
+            chunk = chunks_data[i]
             found_chunks.append({
-                "text": doc.page_content,
-                "metadata": doc.metadata
+                "text": chunk["text"],
+                "metadata": chunk["metadata"],
+                **scores
             })
 
         evidence.append({
@@ -46,5 +177,5 @@ def retrieve_evidence(state):
             "chunks": found_chunks
         })
 
-    print(f"✅ Найдены доказательства для {len(evidence)} гипотез")
-    return {"evidence": evidence}
\ No newline at end of file
+    logger.info(f"✅ Найдены доказательства для {len(evidence)} гипотез")
+    return {"evidence": evidence}
@@ -1,47 +1,87 @@
 # nodes/retrieve_papers.py
 import arxiv
+import logging
 import re
 
+from config import ARXIV_MAX_RESULTS, ARXIV_OFFLINE, ARXIV_PDF_BASE_URL
+from utils.arxiv_cache import arxiv_cache
+from utils.instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+# Один клиент на процесс: он сам выдерживает паузу между запросами к API arXiv
+client = arxiv.Client(page_size=100, delay_seconds=3, num_retries=3)
+
+def _search_arxiv(question: str, max_results: int) -> list:
+    """Живой запрос к arXiv API. Статьи дедуплицируются по базовому arXiv ID."""
+    search = arxiv.Search(
+        query=question,
+        max_results=max_results,
+        sort_by=arxiv.SortCriterion.Relevance
+    )
+
+    count("arxiv_requests")
+    papers = []
+    seen = set()
+    for result in client.results(search):
+        # 🔧 Формируем чистый URL без версии
+        base_id = result.entry_id.split("/")[-1].split("v")[0]
+        pdf_url = f"{ARXIV_PDF_BASE_URL}/{base_id}.pdf"
+
+        # Проверяем формат ID (новый формат arXiv: 2505.24133)
+        if not re.fullmatch(r"\d+\.\d+", base_id):
+            continue
+        if base_id in seen:
+            continue
+        seen.add(base_id)
+
+        papers.append({
+            "entry_id": result.entry_id,
+            "arxiv_id": base_id,
+            "title": result.title,
+            "summary": result.summary,
+            "pdf_url": pdf_url,
+            "published": result.published.strftime("%Y-%m-%d"),
+            "authors": [author.name for author in result.authors]
+        })
+    return papers
+
 def retrieve_papers(state):
     """
     Узел 1: Находит статьи через arXiv API.
     Гарантирует, что pdf_url ведёт на актуальную версию (без v1/v2).
-    
-    Вход: state["question"]
+    Результаты поиска кэшируются локально (TTL — ARXIV_CACHE_TTL); при ARXIV_OFFLINE=1
+    узел отвечает только из кэша.
+
+    Вход: state["question"], необязательно state["max_papers"]
     Выход: state["papers"]
     """
-    print("🔍 Узел: Поиск статей через arXiv API...")
-    
+    logger.info("🔍 Узел: Поиск статей через arXiv API...")
+
     question = state["question"]
-    
-    search = arxiv.Search(
-        query=question,
-        max_results=3,
-        sort_by=arxiv.SortCriterion.Relevance
-    )
-    
-    papers = []
+    max_results = state.get("max_papers") or ARXIV_MAX_RESULTS
+
+    cached = arxiv_cache.get_search(question, max_results, allow_stale=ARXIV_OFFLINE)
+    if cached is not None:
+        logger.info(f"✅ Найдено {len(cached)} статей с PDF (из кэша arXiv).")
+        return {"papers": cached}
+
+    if ARXIV_OFFLINE:
+        papers = arxiv_cache.search_offline(question, max_results)
+        logger.info(f"📴 Офлайн-режим: найдено {len(papers)} статей в локальном кэше.")
+        return {"papers": papers}
+
     try:
-        for result in search.results():
-            # 🔧 Формируем чистый URL без версии
-            base_id = result.entry_id.split("/")[-1].split("v")[0]
-            pdf_url = f"https://arxiv.org/pdf/{base_id}.pdf"
-            
-            # Проверяем формат
-            if not re.match(r"https://arxiv\.org/pdf/\d+\.\d+\.pdf", pdf_url):
-                continue
-                
-            papers.append({
-                "entry_id": result.entry_id,
-                "title": result.title,
-                "summary": result.summary,
-                "pdf_url": pdf_url,
-                "published": result.published.strftime("%Y-%m-%d"),
-                "authors": [author.name for author in result.authors]
-            })
+        papers = _search_arxiv(question, max_results)
     except Exception as e:
-        print(f"❌ Ошибка при поиске статей: {e}")
+        logger.error(f"❌ Ошибка при поиске статей: {e}")
+        # arXiv недоступен — пробуем устаревший кэш
+        stale = arxiv_cache.get_search(question, max_results, allow_stale=True)
+        if stale:
+            logger.info(f"♻️ Используем устаревший кэш: {len(stale)} статей.")
+            return {"papers": stale}
         return {"papers": [], "error": str(e)}
-    
-    print(f"✅ Найдено {len(papers)} статей с PDF.")
-    return {"papers": papers}
\ No newline at end of file
+
+    arxiv_cache.put_search(question, max_results, papers)
+    logger.info(f"✅ Найдено {len(papers)} статей с PDF.")
+    return {"papers": papers}
@@ -1,11 +1,15 @@
 # nodes/synthesize_answer.py
+import logging
+
+logger = logging.getLogger(__name__)
+
 def synthesize_answer(state):
-    print("🧠 Узел: Синтез ответа...")
+    logger.info("🧠 Узел: Синтез ответа...")
     
     evidence_list = state.get("evidence", [])
     
     if not evidence_list:
-        print("⚠️ Нет данных для синтеза.")
+        logger.warning("⚠️ Нет данных для синтеза.")
         return {"final_answer": "❌ Нет данных для формирования ответа."}
 
     confirmed_hypotheses = []
@@ -53,6 +57,6 @@ def synthesize_answer(state):
         lines.append("❌ Ни одна из гипотез не нашла подтверждения в найденных статьях.")
 
     final_answer = "\n".join(lines)
-    print("✅ Ответ сформирован.")
+    logger.info("✅ Ответ сформирован.")
 
     return {"final_answer": final_answer}
\ No newline at end of file
@@ -1,27 +1,23 @@
 # nodes/validate_evidence.py
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-import os
 import json
+import logging
 import re
+import time
 
-from langchain_openai import ChatOpenAI
-llm = ChatOpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.getenv("OPENROUTER_API_KEY"),
-    model="google/gemini-2.0-flash-001"
+from config import (
+    JUDGE_MAX_CONCURRENCY, JUDGE_MODE, JUDGE_MIN_SCORE, JUDGE_STOP_CONFIRMATIONS, JUDGE_STOP_CONFIDENCE,
+    JUDGE_WAVE_SIZE
 )
+from utils import resources
+from utils.async_utils import run_sync
+from utils.llm_cache import cached_abatch, llm_cache
 
-def validate_evidence(state):
-    print("✅ Узел: Валидация доказательств (с учётом метаданных)...")
-    
-    evidence_list = state.get("evidence", [])
-    
-    if not evidence_list:
-        print("⚠️ Нет доказательств для валидации.")
-        return {"evidence": [], "retry_count": state.get("retry_count", 0)}
+logger = logging.getLogger(__name__)
 
-    prompt = ChatPromptTemplate.from_template("""
+JUDGE_MODES = ("per_chunk", "batched")
+
+prompt = ChatPromptTemplate.from_template("""
 Ты — эксперт по научным статьям. Оцени, насколько следующий фрагмент текста **подтверждает** гипотезу.
 
 При оценке учитывай:
@@ -36,50 +32,312 @@ def validate_evidence(state):
 {{"confirmed": true|false, "partial": true|false, "confidence": 0.0–1.0, "reason": "объяснение"}}
 """)
 
-    validated_evidence = []
+batch_prompt = ChatPromptTemplate.from_template("""
+Ты — эксперт по научным статьям. Оцени, насколько **каждый** из следующих фрагментов текста **подтверждает** гипотезу.
+Оценивай фрагменты независимо друг от друга.
+
+При оценке учитывай:
+- Если фрагмент содержит **таблицы, цифры, результаты** — это сильное доказательство.
+- Если фрагмент — только обсуждение или введение — это слабое доказательство.
+
+Гипотеза: {hypothesis}
+
+Фрагменты:
+{chunks}
+
+Верни ТОЛЬКО JSON-массив — по одному объекту на каждый фрагмент, с его id:
+[{{"id": 0, "confirmed": true|false, "partial": true|false, "confidence": 0.0–1.0, "reason": "объяснение"}}]
+""")
+
+
+PARSE_ERROR = {"confirmed": False, "partial": False, "confidence": 0.1, "reason": "parse error"}
+JUDGMENT_KEYS = ("confirmed", "partial", "confidence", "reason")
+
+
+def _parse_judgment(result) -> dict:
+    if isinstance(result, Exception):
+        return dict(PARSE_ERROR)
+    try:
+        json_match = re.search(r'\{.*\}', result.content, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group(0))
+    except ValueError:
+        pass
+    return dict(PARSE_ERROR)
+
+
+def _is_valid_judgment(message) -> bool:
+    return _parse_judgment(message) != PARSE_ERROR
+
+
+def _parse_batch(result, n_chunks: int) -> list:
+    """
+    Разбирает JSON-массив оценок. Возвращает список длины n_chunks;
+    None — для фрагментов, чью оценку не удалось достать (их проверим поштучно).
+    """
+    judgments = [None] * n_chunks
+    if isinstance(result, Exception):
+        return judgments
+    try:
+        json_match = re.search(r'\[.*\]', result.content, re.DOTALL)
+        items = json.loads(json_match.group(0)) if json_match else []
+    except ValueError:
+        return judgments
+    if not isinstance(items, list):
+        return judgments
+
+    for item in items:
+        if not isinstance(item, dict) or not all(key in item for key in JUDGMENT_KEYS):
+            continue
+        try:
+            chunk_id = int(item["id"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if 0 <= chunk_id < n_chunks and judgments[chunk_id] is None:
+            judgments[chunk_id] = {key: item[key] for key in JUDGMENT_KEYS}
+    return judgments
+
+
+def _is_complete_batch(message, n_chunks: int) -> bool:
+    """В кэш идёт только ответ с оценкой для каждого фрагмента — неполный пришлось бы добирать снова."""
+    return None not in _parse_batch(message, n_chunks)
+
+
+def _format_chunks(chunks: list) -> str:
+    return "\n\n".join(
+        f"[id={i}] Метаданные: {chunk['metadata']}\nТекст: {chunk['text']}"
+        for i, chunk in enumerate(chunks)
+    )
 
-    for item in evidence_list:
-        hypothesis = item["hypothesis"]
-        validated_chunks = []
 
-        for chunk_data in item["chunks"]:
-            chunk_text = chunk_data["text"]
-            chunk_metadata = chunk_data["metadata"]
+def _account(stats: dict, results: list):
+    """Учитывает число запросов и токены (usage_metadata) в статистике судьи. Ответы из кэша — бесплатны."""
+    for result in results:
+        if not isinstance(result, Exception) and result.response_metadata.get("cached"):
+            stats["cache_hits"] += 1
+            continue
+        stats["llm_calls"] += 1
+        if isinstance(result, Exception):
+            stats["errors"] += 1
+            continue
+        usage = result.usage_metadata or {}
+        stats["input_tokens"] += usage.get("input_tokens", 0)
+        stats["output_tokens"] += usage.get("output_tokens", 0)
 
-            try:
-                chain = prompt | llm | StrOutputParser()
-                result = chain.invoke({
-                    "hypothesis": hypothesis,
-                    "chunk": chunk_text,
-                    "metadata": chunk_metadata
+
+async def _judge_pairs(llm, pairs: list, stats: dict) -> list:
+    """Пары (гипотеза, чанк) — параллельно, не больше JUDGE_MAX_CONCURRENCY одновременно. Порядок сохраняется."""
+    if not pairs:
+        return []
+    inputs = [
+        {"hypothesis": hypothesis, "chunk": chunk["text"], "metadata": chunk["metadata"]}
+        for hypothesis, chunk in pairs
+    ]
+    results = await cached_abatch(
+        prompt, llm, resources.with_llm_retry(prompt | llm), inputs,
+        config={"max_concurrency": JUDGE_MAX_CONCURRENCY},
+        should_cache=lambda message, i: _is_valid_judgment(message)
+    )
+    _account(stats, results)
+    return [_parse_judgment(result) for result in results]
+
+
+def _gate(evidence_list: list, stats: dict) -> list:
+    """
+    Заготовка оценок по гипотезам: чанк с близостью ниже JUDGE_MIN_SCORE сразу получает отказ
+    без запроса к LLM, для остальных — None (их оценит судья). Чанки без score проверяются всегда.
+    """
+    all_judgments = []
+    for item in evidence_list:
+        judgments = []
+        for chunk in item["chunks"]:
+            score = chunk.get("score")
+            if JUDGE_MIN_SCORE and score is not None and score < JUDGE_MIN_SCORE:
+                judgments.append({
+                    "confirmed": False, "partial": False, "confidence": 0.0,
+                    "reason": f"auto-rejected: близость {score:.2f} ниже порога {JUDGE_MIN_SCORE:.2f}"
                 })
+                stats["auto_rejected"] += 1
+            else:
+                judgments.append(None)
+        all_judgments.append(judgments)
+    return all_judgments
+
+
+def _score(chunk: dict) -> float:
+    score = chunk.get("score")
+    return float("-inf") if score is None else score
+
+
+def _is_strong(judgment: dict) -> bool:
+    """Уверенное подтверждение — после JUDGE_STOP_CONFIRMATIONS таких гипотеза больше не проверяется."""
+    try:
+        return judgment.get("confirmed") is True and float(judgment.get("confidence", 0)) >= JUDGE_STOP_CONFIDENCE
+    except (TypeError, ValueError):
+        return False
+
+
+async def _judge_per_chunk(llm, evidence_list: list, all_judgments: list, stats: dict) -> list:
+    """
+    Каскад: чанки каждой гипотезы идут к судье по убыванию близости, волнами по JUDGE_WAVE_SIZE
+    (волна — один параллельный батч по всем ещё открытым гипотезам). После JUDGE_STOP_CONFIRMATIONS
+    уверенных подтверждений гипотеза закрывается, её оставшиеся чанки не проверяются (оценка None).
+    JUDGE_WAVE_SIZE=0 — все чанки одной волной: один раунд запросов, как без каскада.
+    """
+    queues = [
+        sorted(
+            (j for j, judgment in enumerate(judgments) if judgment is None),
+            key=lambda j, chunks=item["chunks"]: -_score(chunks[j])
+        )
+        for item, judgments in zip(evidence_list, all_judgments)
+    ]
+    early_stop = JUDGE_STOP_CONFIRMATIONS > 0 and JUDGE_WAVE_SIZE > 0
+    wave_size = JUDGE_WAVE_SIZE if early_stop else max(map(len, queues), default=1)
+    confirmations = [0] * len(queues)
+
+    while True:
+        wave = []
+        for i, queue in enumerate(queues):
+            if early_stop and confirmations[i] >= JUDGE_STOP_CONFIRMATIONS:
+                continue
+            wave.extend((i, j) for j in queue[:wave_size])
+            del queue[:wave_size]
+        if not wave:
+            break
+        stats["waves"] += 1
+        judged = await _judge_pairs(
+            llm, [(evidence_list[i]["hypothesis"], evidence_list[i]["chunks"][j]) for i, j in wave], stats
+        )
+        for (i, j), judgment in zip(wave, judged):
+            all_judgments[i][j] = judgment
+            confirmations[i] += _is_strong(judgment)
+
+    stats["skipped"] = sum(len(queue) for queue in queues)
+    stats["llm_calls_saved"] = stats["auto_rejected"] + stats["skipped"]
+    return all_judgments
+
+
+async def _judge_batched(llm, evidence_list: list, all_judgments: list, stats: dict) -> list:
+    """Один запрос на гипотезу с её непрошедшими фильтр чанками; без валидной оценки в ответе — поштучно."""
+    open_chunks = [[j for j, judgment in enumerate(judgments) if judgment is None] for judgments in all_judgments]
+    batched = [i for i, positions in enumerate(open_chunks) if positions]
+    sizes = [len(open_chunks[i]) for i in batched]
+    results = await cached_abatch(
+        batch_prompt, llm, resources.with_llm_retry(batch_prompt | llm),
+        [
+            {
+                "hypothesis": evidence_list[i]["hypothesis"],
+                "chunks": _format_chunks([evidence_list[i]["chunks"][j] for j in open_chunks[i]])
+            }
+            for i in batched
+        ],
+        config={"max_concurrency": JUDGE_MAX_CONCURRENCY},
+        should_cache=lambda message, k: _is_complete_batch(message, sizes[k])
+    )
+    _account(stats, results)
+    # Гипотеза, у которой фильтр по близости отсёк все чанки, обходится без запроса
+    stats["llm_calls_saved"] = sum(
+        1 for item, positions in zip(evidence_list, open_chunks) if item["chunks"] and not positions
+    )
+
+    missing = []
+    for i, result in zip(batched, results):
+        for j, judgment in zip(open_chunks[i], _parse_batch(result, len(open_chunks[i]))):
+            if judgment is None:
+                missing.append((i, j))
+            else:
+                all_judgments[i][j] = judgment
 
-                json_match = re.search(r'\{.*\}', result, re.DOTALL)
-                if json_match:
-                    judgment = json.loads(json_match.group(0))
-                else:
-                    judgment = {"confirmed": False, "partial": False, "confidence": 0.1, "reason": "parse error"}
+    if missing:
+        logger.warning(f"⚠️ Пакетная оценка неполная: {len(missing)} фрагментов проверяем поштучно")
+        calls_before = stats["llm_calls"]
+        fallback = await _judge_pairs(
+            llm,
+            [(evidence_list[i]["hypothesis"], evidence_list[i]["chunks"][j]) for i, j in missing],
+            stats
+        )
+        stats["fallback_calls"] += stats["llm_calls"] - calls_before
+        for (i, j), judgment in zip(missing, fallback):
+            all_judgments[i][j] = judgment
 
-            except Exception:
-                judgment = {"confirmed": False, "partial": False, "confidence": 0.1, "reason": "parse error"}
+    return all_judgments
 
+
+def validate_evidence(state):
+    """
+    Узел 5: LLM-as-a-Judge для найденных фрагментов.
+    Режим (state["judge_mode"] или JUDGE_MODE): "per_chunk" — запрос на каждый фрагмент,
+    "batched" — один запрос на гипотезу со всеми её фрагментами.
+    Фрагменты с близостью ниже JUDGE_MIN_SCORE отклоняются без LLM; в per_chunk проверка идёт
+    по убыванию близости и останавливается на гипотезе после достаточного числа подтверждений —
+    непроверенные фрагменты в validated_chunks не попадают.
+    Число запросов (и сэкономленных), токены и задержка пишутся в state["judge_stats"].
+    """
+    logger.info("✅ Узел: Валидация доказательств (с учётом метаданных)...")
+
+    evidence_list = state.get("evidence", [])
+
+    if not evidence_list:
+        logger.warning("⚠️ Нет доказательств для валидации.")
+        return {"evidence": [], "retry_count": state.get("retry_count", 0)}
+
+    mode = state.get("judge_mode") or JUDGE_MODE
+    if mode not in JUDGE_MODES:
+        logger.warning(f"⚠️ Неизвестный режим судьи '{mode}' — используем per_chunk")
+        mode = "per_chunk"
+
+    stats = {
+        "mode": mode,
+        "chunks": sum(len(item["chunks"]) for item in evidence_list),
+        "llm_calls": 0,
+        "cache_hits": 0,
+        "fallback_calls": 0,
+        "errors": 0,
+        "auto_rejected": 0,
+        "skipped": 0,
+        "waves": 0,
+        "llm_calls_saved": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+    }
+    llm = resources.get("llm")
+    started = time.perf_counter()
+    all_judgments = _gate(evidence_list, stats)
+    if mode == "batched":
+        all_judgments = run_sync(_judge_batched(llm, evidence_list, all_judgments, stats))
+    else:
+        all_judgments = run_sync(_judge_per_chunk(llm, evidence_list, all_judgments, stats))
+    stats["latency_s"] = round(time.perf_counter() - started, 3)
+    logger.info(f"⚖️ Судья: {stats}")
+    logger.info(f"🗃️ Кэш LLM: {llm_cache.stats()}")
+
+    validated_evidence = []
+
+    for item, judgments in zip(evidence_list, all_judgments):
+        validated_chunks = []
+
+        for chunk_data, judgment in zip(item["chunks"], judgments):
+            if judgment is None:
+                continue  # не проверялся: гипотеза уже подтверждена
             validated_chunks.append({
-                "text": chunk_text,
-                "metadata": chunk_metadata,
+                "text": chunk_data["text"],
+                "metadata": chunk_data["metadata"],
+                "score": chunk_data.get("score"),
                 "judgment": judgment
             })
 
         validated_evidence.append({
-            "hypothesis": hypothesis,
+            "hypothesis": item["hypothesis"],
             "validated_chunks": validated_chunks
         })
 
-    print("✅ Все доказательства проверены.")
-    
+    logger.info("✅ Все доказательства проверены.")
+
     current_retry = state.get("retry_count", 0)
     new_retry = current_retry + 1 if current_retry == 0 else current_retry
 
     return {
         "evidence": validated_evidence,
-        "retry_count": new_retry
-    }
\ No newline at end of file
+        "retry_count": new_retry,
+        "judge_stats": stats
+    }
@@ -0,0 +1,236 @@
+# server.py
+"""
+HTTP-сервис вокруг скомпилированного графа.
+
+    uvicorn server:api --host 0.0.0.0 --port 8000
+    curl -N "localhost:8000/ask/stream?question=Какие+методы+снижают+KV-cache%3F"
+
+Один процесс держит прогретые модели и общий LLM-клиент для всех пользователей.
+GET /ask/stream отдаёт прогресс по узлам через Server-Sent Events (app.astream, stream_mode="updates"):
+статьи, гипотезы, найденные и проверенные доказательства приходят по мере готовности, ответ — последним.
+POST /ask возвращает итог одним JSON. Одновременно выполняется не больше SERVICE_MAX_CONCURRENT
+прогонов, остальные ждут в очереди; если очередь заполнена — сразу 503.
+"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from config import PREWARM_RESOURCES, SERVICE_MAX_CONCURRENT, SERVICE_MAX_QUEUE, SERVICE_QUEUE_TIMEOUT
+from state import initial_state
+from utils import resources
+from utils.instrumentation import make_trace, merge_metrics, setup_logging, write_trace
+
+logger = logging.getLogger(__name__)
+
+GRAPH_CONFIG = {"recursion_limit": 10}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Reservation:
+    """Место в очереди. release() можно звать сколько угодно раз — место вернётся ровно один раз."""
+
+    def __init__(self, admission: "Admission"):
+        self.admission = admission
+        self.active = True
+
+    def release(self):
+        if self.active:
+            self.active = False
+            self.admission.waiting -= 1
+
+
+class Admission:
+    """Не больше max_running прогонов одновременно и не больше max_queue ждущих."""
+
+    def __init__(self, max_running: int, max_queue: int, timeout: float):
+        self.max_running = max_running
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(max_running)
+
+    def reserve(self) -> Reservation:
+        """Место в очереди. Берётся до начала ответа, чтобы переполнение вернуло 503, а не ошибку в потоке."""
+        if self.running >= self.max_running and self.waiting >= self.max_queue:
+            raise Overloaded(f"очередь заполнена ({self.waiting} ждут)")
+        self.waiting += 1
+        return Reservation(self)
+
+    @asynccontextmanager
+    async def slot(self, reservation: Reservation = None):
+        reservation = reservation or self.reserve()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded(f"не дождались места за {self.timeout} с")
+        finally:
+            reservation.release()
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+
+admission = Admission(SERVICE_MAX_CONCURRENT, SERVICE_MAX_QUEUE, SERVICE_QUEUE_TIMEOUT)
+graph_app = None
+
+
+@asynccontextmanager
+async def lifespan(_):
+    global graph_app
+    setup_logging()
+    from graph import app
+    from nodes.extract_text import shutdown_parse_pool
+    graph_app = app
+    if PREWARM_RESOURCES:
+        # Модели загружаются один раз до первого запроса и делятся всеми клиентами
+        await asyncio.to_thread(resources.prewarm, None, False)
+    yield
+    shutdown_parse_pool()
+
+
+api = FastAPI(title="Research Assistant", lifespan=lifespan)
+
+
+class AskRequest(BaseModel):
+    question: str
+    max_papers: Optional[int] = None
+    retrieval_k: Optional[int] = None
+    retrieval_filter: Optional[List[str]] = None
+    retrieval_mode: Optional[str] = None
+    judge_mode: Optional[str] = None
+
+
+def _public_update(update: dict) -> dict:
+    """Обновление узла для клиента: всё, кроме полного списка чанков (только их число)."""
+    payload = {key: value for key, value in update.items() if key != "chunks_with_metadata"}
+    if "chunks_with_metadata" in update:
+        payload["chunks"] = len(update["chunks_with_metadata"])
+    return payload
+
+
+async def run_graph(request: AskRequest):
+    """Прогон графа потоком обновлений: (имя узла, обновление). В конце пишет трейс и отдаёт ("done", trace)."""
+    state = initial_state(request.question, **request.model_dump(exclude={"question"}))
+    started = time.perf_counter()
+    metrics = {}
+    async for chunk in graph_app.astream(state, config=GRAPH_CONFIG, stream_mode="updates"):
+        for node, update in chunk.items():
+            update = update or {}
+            metrics = merge_metrics(metrics, update.get("metrics"))
+            yield node, update
+    trace = make_trace(request.question, metrics, started)
+    write_trace(trace)
+    yield "done", trace
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class ReservedStreamingResponse(StreamingResponse):
+    """
+    Поток, который возвращает место в очереди при любом исходе: клиент может уйти
+    до первого байта, и тогда генератор событий так и не запустится.
+    """
+
+    def __init__(self, content, reservation: Reservation, **kwargs):
+        super().__init__(content, **kwargs)
+        self.reservation = reservation
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.reservation.release()
+
+
+async def _event_stream(request: AskRequest, reservation: Reservation):
+    try:
+        yield _sse("queued", {"running": admission.running, "waiting": admission.waiting})
+        async with admission.slot(reservation):
+            yield _sse("started", {})
+            async for node, update in run_graph(request):
+                if node == "done":
+                    yield _sse("done", update)
+                else:
+                    yield _sse("node", {"node": node, **_public_update(update)})
+    except Overloaded as e:
+        yield _sse("error", {"error": f"Сервис перегружен: {e}"})
+    except Exception as e:
+        logger.error(f"❌ Ошибка прогона: {e}")
+        yield _sse("error", {"error": str(e)})
+    finally:
+        reservation.release()
+
+
+@api.get("/ask/stream")
+async def ask_stream(
+    question: str,
+    max_papers: Optional[int] = None,
+    retrieval_k: Optional[int] = None,
+    retrieval_filter: Optional[List[str]] = Query(None),
+    retrieval_mode: Optional[str] = None,
+    judge_mode: Optional[str] = None,
+):
+    request = AskRequest(
+        question=question, max_papers=max_papers, retrieval_k=retrieval_k,
+        retrieval_filter=retrieval_filter, retrieval_mode=retrieval_mode, judge_mode=judge_mode
+    )
+    try:
+        reservation = admission.reserve()
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    return ReservedStreamingResponse(
+        _event_stream(request, reservation),
+        reservation,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@api.post("/ask")
+async def ask(request: AskRequest):
+    final = {}
+    try:
+        async with admission.slot():
+            async for node, update in run_graph(request):
+                if node == "done":
+                    final["trace"] = update
+                else:
+                    final.update(_public_update(update))
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    final.pop("metrics", None)
+    return final
+
+
+@api.get("/health")
+async def health():
+    return {
+        "ready": graph_app is not None,
+        "running": admission.running,
+        "waiting": admission.waiting,
+        "resources": resources.timings(),
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(api, host="0.0.0.0", port=8000)
@@ -1,5 +1,17 @@
 # state.py
-from typing import TypedDict, List, Dict, Any
+from typing import TypedDict, List, Dict, Any, Annotated
+
+from utils.instrumentation import merge_metrics
+
+
+def merge_errors(left: str, right: str) -> str:
+    """Редьюсер для error: параллельные ветки могут упасть одновременно — сохраняем обе ошибки."""
+    if not left:
+        return right or ""
+    if not right or right in left:
+        return left
+    return f"{left}; {right}"
+
 
 class GraphState(TypedDict):
     question: str
@@ -9,4 +21,32 @@ class GraphState(TypedDict):
     evidence: List[Dict[str, Any]]
     final_answer: str
     retry_count: int
-    error: str
\ No newline at end of file
+    # retrieve_papers и generate_hypotheses работают параллельно и обе могут записать ошибку
+    error: Annotated[str, merge_errors]
+    # Необязательно: сколько статей запрашивать у arXiv (по умолчанию ARXIV_MAX_RESULTS)
+    max_papers: int
+    # Необязательные параметры поиска доказательств (по умолчанию — из config.py)
+    retrieval_k: int
+    retrieval_filter: List[str]
+    retrieval_mode: str  # "dense" | "hybrid"
+    # Режим LLM-судьи ("per_chunk" | "batched") и статистика его запросов
+    judge_mode: str
+    judge_stats: Dict[str, Any]
+    # Метрики узлов (utils/instrumentation.py): время, число элементов, запросы, кэши
+    metrics: Annotated[Dict[str, Any], merge_metrics]
+
+
+def initial_state(question: str, **params) -> dict:
+    """Начальное состояние графа; params — необязательные поля (max_papers, retrieval_k, judge_mode...)."""
+    state = {
+        "question": question,
+        "papers": [],
+        "chunks_with_metadata": [],
+        "hypotheses": [],
+        "evidence": [],
+        "final_answer": "",
+        "retry_count": 0,
+        "error": "",
+    }
+    state.update({key: value for key, value in params.items() if value is not None})
+    return state
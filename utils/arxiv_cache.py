@@ -0,0 +1,130 @@
+# utils/arxiv_cache.py
+"""
+Локальный кэш поиска arXiv (SQLite).
+searches: нормализованный запрос → список arXiv ID (с TTL);
+papers: по одной записи на базовый arXiv ID (title, summary, authors, pdf_url, ...).
+В офлайн-режиме отвечает на незнакомые запросы поиском по словам в сохранённых статьях.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from config import ARXIV_CACHE_PATH, ARXIV_CACHE_TTL
+from utils.instrumentation import count
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
+class ArxivCache:
+    def __init__(self, path: str = ARXIV_CACHE_PATH, ttl: int = ARXIV_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS searches (
+                    query TEXT NOT NULL,
+                    max_results INTEGER NOT NULL,
+                    ids TEXT NOT NULL,
+                    fetched REAL NOT NULL,
+                    PRIMARY KEY (query, max_results)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS papers (
+                    arxiv_id TEXT PRIMARY KEY,
+                    record TEXT NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def _papers(self, conn: sqlite3.Connection, ids: list) -> list:
+        records = {}
+        for arxiv_id, record in conn.execute(
+            f"SELECT arxiv_id, record FROM papers WHERE arxiv_id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall():
+            records[arxiv_id] = json.loads(record)
+        return [records[arxiv_id] for arxiv_id in ids if arxiv_id in records]
+
+    def get_search(self, query: str, max_results: int, allow_stale: bool = False):
+        """Статьи по запросу из кэша или None. allow_stale — игнорировать TTL (офлайн / arXiv недоступен)."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT ids, fetched FROM searches WHERE query = ? AND max_results = ?",
+                    (normalize_query(query), max_results)
+                ).fetchone()
+                if row is None or (not allow_stale and row[1] < time.time() - self.ttl):
+                    self.misses += 1
+                    count("arxiv_cache_misses")
+                    return None
+                self.hits += 1
+                count("arxiv_cache_hits")
+                return self._papers(conn, json.loads(row[0]))
+            finally:
+                conn.close()
+
+    def put_search(self, query: str, max_results: int, papers: list):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO papers VALUES (?, ?, ?)",
+                    [(paper["arxiv_id"], json.dumps(paper, ensure_ascii=False), now) for paper in papers]
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)",
+                    (normalize_query(query), max_results, json.dumps([paper["arxiv_id"] for paper in papers]), now)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+
+    def search_offline(self, query: str, max_results: int) -> list:
+        """Поиск по словам запроса в заголовках и аннотациях сохранённых статей."""
+        terms = set(re.findall(r"\w{3,}", query.casefold()))
+        if not terms:
+            return []
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute("SELECT record FROM papers").fetchall()
+            finally:
+                conn.close()
+
+        scored = []
+        for (record,) in rows:
+            paper = json.loads(record)
+            title_words = set(re.findall(r"\w{3,}", paper["title"].casefold()))
+            summary_words = set(re.findall(r"\w{3,}", paper["summary"].casefold()))
+            score = 2 * len(terms & title_words) + len(terms & summary_words)
+            if score:
+                scored.append((score, paper))
+        scored.sort(key=lambda item: -item[0])
+        return [paper for _, paper in scored[:max_results]]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+arxiv_cache = ArxivCache()
@@ -0,0 +1,47 @@
+# utils/async_utils.py
+"""
+Запуск корутин из синхронных узлов LangGraph.
+Все корутины крутятся в одном фоновом event loop: асинхронный HTTP-клиент ChatOpenAI
+привязан к циклу, в котором создан, и не переживает asyncio.run() на каждый вызов.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+
+_loop = None
+_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-utils-loop", daemon=True).start()
+        return _loop
+
+
+def run_sync(coro):
+    """
+    Выполняет корутину в фоновом цикле и возвращает результат (блокирует текущий поток).
+    Задача получает копию контекста вызывающего потока — счётчики instrumentation.count() не теряются.
+    """
+    loop = _get_loop()
+    context = contextvars.copy_context()
+    result = concurrent.futures.Future()
+
+    def _done(task: asyncio.Task):
+        if task.cancelled():
+            result.cancel()
+        elif task.exception() is not None:
+            result.set_exception(task.exception())
+        else:
+            result.set_result(task.result())
+
+    def _start():
+        task = context.run(loop.create_task, coro)
+        task.add_done_callback(_done)
+
+    loop.call_soon_threadsafe(_start)
+    return result.result()
@@ -0,0 +1,66 @@
+# utils/bm25.py
+"""
+Лексический индекс BM25 над чанками одного запроса.
+Строится за один проход по текстам (инвертированный индекс: термин → документы и частоты)
+и позволяет выбрать кандидатов для плотного поиска, не эмбеддя весь корпус.
+"""
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+_TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were with we our "
+    "which can than these those using into also not".split()
+)
+
+
+def tokenize(text: str) -> list:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS and len(token) > 1]
+
+
+class BM25Index:
+    def __init__(self, texts: list, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(texts)
+        postings = {}
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[doc] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc)
+                postings[term][1].append(tf)
+        self.postings = {
+            term: (np.array(docs, dtype=np.int64), np.array(tfs, dtype=np.float32))
+            for term, (docs, tfs) in postings.items()
+        }
+        avg_length = float(lengths.mean()) if len(texts) else 0.0
+        # Знаменатель BM25 без tf: k1 * (1 - b + b * |d| / avgdl)
+        self._norm = self.k1 * (1 - self.b + self.b * lengths / (avg_length or 1.0))
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings[term][0]) if term in self.postings else 0
+        return math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 каждого документа для запроса; 0 — нет общих терминов."""
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            docs, tfs = self.postings[term]
+            scores[docs] += self.idf(term) * tfs * (self.k1 + 1) / (tfs + self._norm[docs])
+        return scores
+
+
+def top_n(scores: np.ndarray, n: int) -> np.ndarray:
+    """Номера до n документов с наибольшим BM25 (только > 0), по убыванию."""
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > n:
+        candidates = candidates[np.argpartition(-scores[candidates], n - 1)[:n]]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
@@ -1,31 +1,332 @@
 # utils/cache.py
+"""
+Кэш PDF на диске с адресацией по содержимому.
+Файлы лежат в blobs/ под SHA-256 своего содержимого (одинаковые PDF по разным URL хранятся один раз),
+соответствие URL → хеш и время последнего доступа — в SQLite. Скачивание идёт потоком во временный
+файл и переименовывается атомарно только после проверки целостности, поэтому оборванная загрузка
+никогда не станет «попаданием». Одну и ту же ссылку одновременно качает только один поток/процесс:
+в процессе — SingleFlight по URL, между процессами — lock-файл по хешу URL, который удаляется после
+публикации; остальные ждут и берут готовый файл, загрузки других ссылок друг друга не ждут. Сверх
+PDF_CACHE_MAX_BYTES вытесняются давно не использованные файлы. Файлы старого формата
+(<md5(URL)>.pdf в корне кэша) при первом открытии переносятся в blobs/ и учитываются в лимите.
+"""
+import hashlib
+import logging
+import mmap
 import os
-import requests
+import re
+import sqlite3
+import threading
+import time
+import uuid
 from pathlib import Path
-import hashlib
 
-CACHE_DIR = Path("cache/pdfs")
-CACHE_DIR.mkdir(exist_ok=True)
+import requests
+
+from config import PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES
+from utils.file_lock import file_lock, transient_file_lock
+from utils.instrumentation import count
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK = 64 * 1024
+# Файлы, к которым обращались недавно, не вытесняются: их может прямо сейчас читать разбор PDF
+EVICT_GRACE_SECONDS = 300
+# Недокачанные временные файлы старше этого удаляются при старте
+STALE_PART_SECONDS = 3600
+LEGACY_NAME = re.compile(r"^[0-9a-f]{32}\.pdf$")
+
 
-def download_pdf_cached(pdf_url: str, timeout: int = 15) -> Path:
+def check_pdf(path: Path, expected_size: int = None, full: bool = True) -> bool:
     """
-    Скачивает PDF по URL и кэширует его.
-    Возвращает путь к файлу.
+    Проверка целостности: размер и заголовок %PDF-; full — ещё и маркер %%EOF где угодно в файле
+    (после него бывает мусор, поэтому ищем не только в хвосте). Для уже проверенных файлов
+    из кэша хватает размера: обрыв или усечение его меняют.
     """
-    # Генерируем имя файла по хешу URL
-    filename = hashlib.md5(pdf_url.encode()).hexdigest() + ".pdf"
-    filepath = CACHE_DIR / filename
+    try:
+        size = path.stat().st_size
+        if size < 16 or (expected_size is not None and size != expected_size):
+            return False
+        with open(path, "rb") as f:
+            if f.read(5) != b"%PDF-":
+                return False
+            if not full:
+                return True
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return data.rfind(b"%%EOF") != -1
+    except (OSError, ValueError):
+        return False
+
+
+class PdfCache:
+    def __init__(self, root: str = PDF_CACHE_DIR, max_bytes: int = PDF_CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.blobs_dir = self.root / "blobs"
+        self.tmp_dir = self.root / "tmp"
+        self.locks_dir = self.root / "locks"
+        self.db_path = self.root / "index.sqlite"
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.corrupt = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._downloads = SingleFlight("pdf_cache_download")
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            for directory in (self.blobs_dir, self.tmp_dir, self.locks_dir):
+                directory.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, sha256 TEXT NOT NULL)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS blobs_lru ON blobs (last_access)")
+            # Файлы старого формата: URL неизвестен, только его MD5 — связываем при первом запросе
+            conn.execute("CREATE TABLE IF NOT EXISTS legacy (md5 TEXT PRIMARY KEY, sha256 TEXT NOT NULL)")
+            conn.commit()
+            self._remove_stale_files()
+            self._import_legacy(conn)
+            self._initialized = True
+        return conn
+
+    def _import_legacy(self, conn: sqlite3.Connection):
+        """Переносит <md5(URL)>.pdf из корня кэша в blobs/; битые файлы удаляет."""
+        legacy = [path for path in self.root.glob("*.pdf") if LEGACY_NAME.match(path.name)]
+        if not legacy:
+            return
+        with file_lock(str(self.locks_dir / "legacy.lock")):
+            imported = 0
+            for path in legacy:
+                try:
+                    if not check_pdf(path):
+                        path.unlink()
+                        continue
+                    digest = hashlib.sha256()
+                    with open(path, "rb") as f:
+                        for block in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+                            digest.update(block)
+                    sha256 = digest.hexdigest()
+                    size = path.stat().st_size
+                    last_access = path.stat().st_mtime
+                    blob = self.blob_path(sha256)
+                    blob.parent.mkdir(parents=True, exist_ok=True)
+                    if check_pdf(blob, size, full=False):
+                        path.unlink()
+                    else:
+                        os.replace(path, blob)
+                except FileNotFoundError:
+                    continue  # перенёс другой процесс
+                conn.execute(
+                    "INSERT OR IGNORE INTO blobs VALUES (?, ?, ?)", (sha256, size, last_access)
+                )
+                conn.execute("INSERT OR REPLACE INTO legacy VALUES (?, ?)", (path.stem, sha256))
+                imported += 1
+            self._evict(conn, keep=None)
+            conn.commit()
+        if imported:
+            logger.info(f"📦 Кэш PDF: перенесено {imported} файлов старого формата")
+
+    def _remove_stale_files(self):
+        """
+        Недокачанные .part, lock-файлы загрузок, оставшиеся после падения процесса,
+        и lock-файлы полос (000.lock…255.lock) прошлой версии.
+        """
+        cutoff = time.time() - STALE_PART_SECONDS
+        stale = list(self.tmp_dir.glob("*.part")) + [
+            path for path in self.locks_dir.glob("*.lock") if len(path.stem) in (3, 64)
+        ]
+        for path in stale:
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.blobs_dir / sha256[:2] / f"{sha256}.pdf"
 
-    if filepath.exists():
-        print(f"📄 Используем кэш: {filepath}")
-        return filepath
+    def _lookup(self, url: str):
+        """Путь к целому файлу для URL или None. Битые записи удаляются."""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT blobs.sha256, blobs.size FROM urls JOIN blobs ON urls.sha256 = blobs.sha256 WHERE url = ?",
+                (url,)
+            ).fetchone()
+            if row is None:
+                row = self._adopt_legacy(conn, url)
+            if row is None:
+                return None
+            sha256, size = row
+            path = self.blob_path(sha256)
+            if not check_pdf(path, size, full=False):
+                logger.warning(f"⚠️ Повреждённый файл в кэше PDF, скачаем заново: {url}")
+                with self._lock:
+                    self.corrupt += 1
+                count("pdf_cache_corrupt")
+                conn.execute("DELETE FROM urls WHERE sha256 = ?", (sha256,))
+                conn.execute("DELETE FROM legacy WHERE sha256 = ?", (sha256,))
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                conn.commit()
+                path.unlink(missing_ok=True)
+                return None
+            conn.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ?", (time.time(), sha256))
+            conn.commit()
+            return path
+        finally:
+            conn.close()
 
-    print(f"📥 Скачиваем PDF: {pdf_url}")
-    response = requests.get(pdf_url, timeout=timeout)
-    response.raise_for_status()
+    def _adopt_legacy(self, conn: sqlite3.Connection, url: str):
+        """Файл старого формата для этого URL: записывает соответствие URL → хеш. (sha256, size) или None."""
+        md5 = hashlib.md5(url.encode()).hexdigest()
+        row = conn.execute(
+            "SELECT blobs.sha256, blobs.size FROM legacy JOIN blobs ON legacy.sha256 = blobs.sha256 WHERE md5 = ?",
+            (md5,)
+        ).fetchone()
+        if row is not None:
+            conn.execute("INSERT OR REPLACE INTO urls VALUES (?, ?)", (url, row[0]))
+            conn.execute("DELETE FROM legacy WHERE md5 = ?", (md5,))
+            conn.commit()
+        return row
 
-    with open(filepath, "wb") as f:
-        f.write(response.content)
+    def _download(self, url: str, timeout: int, session, max_bytes: int) -> Path:
+        tmp_path = self.tmp_dir / f"{uuid.uuid4().hex}.part"
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            with (session or requests).get(url, timeout=timeout, stream=True) as response:
+                response.raise_for_status()
+                declared = int(response.headers.get("Content-Length") or 0)
+                if max_bytes and declared > max_bytes:
+                    raise ValueError(f"PDF больше лимита: {declared} > {max_bytes} байт")
 
-    print(f"💾 Сохранён в кэш: {filepath}")
-    return filepath
\ No newline at end of file
+                with open(tmp_path, "wb") as f:
+                    for block in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                        written += len(block)
+                        if max_bytes and written > max_bytes:
+                            raise ValueError(f"PDF больше лимита: > {max_bytes} байт")
+                        digest.update(block)
+                        f.write(block)
+                    f.flush()
+                    os.fsync(f.fileno())
+            count("bytes_downloaded", written)
+
+            if declared and written != declared and "Content-Encoding" not in response.headers:
+                raise ValueError(f"Оборванная загрузка: {written} из {declared} байт")
+            if not check_pdf(tmp_path, written):
+                raise ValueError("Файл не похож на целый PDF (нет %PDF- или %%EOF)")
+
+            sha256 = digest.hexdigest()
+            path = self.blob_path(sha256)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if check_pdf(path, written, full=False):
+                tmp_path.unlink()  # тот же PDF уже есть под другим URL
+            else:
+                os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        conn = self._connect()
+        try:
+            conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", (sha256, written, time.time()))
+            conn.execute("INSERT OR REPLACE INTO urls VALUES (?, ?)", (url, sha256))
+            self._evict(conn, keep=sha256)
+            conn.commit()
+        finally:
+            conn.close()
+        return path
+
+    def _evict(self, conn: sqlite3.Connection, keep: str):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if not self.max_bytes or total <= self.max_bytes:
+            return
+        cutoff = time.time() - EVICT_GRACE_SECONDS
+        rows = conn.execute(
+            "SELECT sha256, size FROM blobs WHERE last_access < ? ORDER BY last_access", (cutoff,)
+        ).fetchall()
+        for sha256, size in rows:
+            if total <= self.max_bytes:
+                break
+            if sha256 == keep:
+                continue
+            conn.execute("DELETE FROM urls WHERE sha256 = ?", (sha256,))
+            conn.execute("DELETE FROM legacy WHERE sha256 = ?", (sha256,))
+            conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            self.blob_path(sha256).unlink(missing_ok=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+            count("pdf_cache_evictions")
+
+    def fetch(self, url: str, timeout: int = 15, session: requests.Session = None, max_bytes: int = 0) -> Path:
+        """Путь к PDF по URL: из кэша или после скачивания. Параллельные вызовы с одним URL качают один раз."""
+        path = self._lookup(url)
+        if path is None:
+            return self._downloads.do(url, self._fetch_missing, url, timeout, session, max_bytes)
+        self._hit(path)
+        return path
+
+    def _fetch_missing(self, url: str, timeout: int, session, max_bytes: int) -> Path:
+        lock_path = self.locks_dir / f"{hashlib.sha256(url.encode()).hexdigest()}.lock"
+        with transient_file_lock(str(lock_path)):
+            # Пока ждали блокировку, файл мог скачать другой процесс
+            path = self._lookup(url)
+            if path is not None:
+                self._hit(path)
+                return path
+            with self._lock:
+                self.misses += 1
+            count("pdf_cache_misses")
+            logger.info(f"📥 Скачиваем PDF: {url}")
+            path = self._download(url, timeout, session, max_bytes)
+            logger.info(f"💾 Сохранён в кэш: {path}")
+            return path
+
+    def _hit(self, path: Path):
+        with self._lock:
+            self.hits += 1
+        count("pdf_cache_hits")
+        logger.info(f"📄 Используем кэш: {path}")
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        try:
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            urls = conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+        finally:
+            conn.close()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "corrupt": self.corrupt,
+            "evictions": self.evictions,
+            "files": entries,
+            "urls": urls,
+            "bytes": total,
+        }
+
+
+pdf_cache = PdfCache()
+
+
+def download_pdf_cached(pdf_url: str, timeout: int = 15, session: requests.Session = None,
+                        max_bytes: int = 0) -> Path:
+    """
+    Скачивает PDF по URL и кэширует его.
+    Возвращает путь к файлу.
+    Если передан session — запрос идёт через его пул соединений.
+    Ответ пишется на диск потоком, кусками по 64 КБ; max_bytes > 0 — предел размера PDF.
+    """
+    return pdf_cache.fetch(pdf_url, timeout=timeout, session=session, max_bytes=max_bytes)
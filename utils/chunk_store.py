@@ -0,0 +1,133 @@
+# utils/chunk_store.py
+"""
+Хранилище разобранных статей на диске (SQLite).
+Ключ — базовый arXiv ID + хеш настроек chunking. Хранит готовые chunks_with_metadata (zlib),
+так что повторная статья не разбирается заново; для статей без структуры или техники — только статус.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from config import CHUNK_STORE_PATH, CHUNK_STORE_MAX_BYTES
+from utils.instrumentation import count
+
+
+def settings_hash(chunk_size: int, chunk_overlap: int, separators: list, version: str = "") -> str:
+    """Хеш настроек splitter'а: другие настройки — другие чанки — другой ключ."""
+    payload = json.dumps(
+        {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "separators": separators, "version": version},
+        sort_keys=True
+    )
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+class ChunkStore:
+    def __init__(self, path: str = CHUNK_STORE_PATH, max_bytes: int = CHUNK_STORE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS papers (
+                    arxiv_id TEXT NOT NULL,
+                    settings TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    text BLOB,  -- не используется: текст больше не хранится
+                    chunks BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (arxiv_id, settings)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS papers_lru ON papers (last_access)")
+            # Записи прошлых версий хранили ещё и полный текст — освобождаем место под лимитом
+            conn.execute("UPDATE papers SET text = NULL, size = length(chunks) WHERE text IS NOT NULL")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def get(self, arxiv_id: str, settings: str):
+        """Возвращает {"status", "chunks"} или None, если статьи нет в хранилище."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    "SELECT status, chunks FROM papers WHERE arxiv_id = ? AND settings = ?",
+                    (arxiv_id, settings)
+                ).fetchone()
+                if row is None:
+                    self.misses += 1
+                    count("chunk_store_misses")
+                    return None
+                conn.execute(
+                    "UPDATE papers SET last_access = ? WHERE arxiv_id = ? AND settings = ?",
+                    (time.time(), arxiv_id, settings)
+                )
+                conn.commit()
+                self.hits += 1
+                count("chunk_store_hits")
+            finally:
+                conn.close()
+        return {"status": row[0], "chunks": json.loads(zlib.decompress(row[1]))}
+
+    def put(self, arxiv_id: str, settings: str, result: dict):
+        """Сохраняет результат process_pdf и вытесняет давно не использованные статьи сверх лимита."""
+        chunks_blob = zlib.compress(json.dumps(result["chunks"], ensure_ascii=False).encode())
+        size = len(chunks_blob)
+
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO papers (arxiv_id, settings, status, chunks, size, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (arxiv_id, settings, result["status"], chunks_blob, size, time.time())
+                )
+                self._evict(conn)
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM papers").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Удаляем самые старые по доступу записи, пока не уложимся в лимит
+        rows = conn.execute("SELECT arxiv_id, settings, size FROM papers ORDER BY last_access").fetchall()
+        for arxiv_id, settings, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM papers WHERE arxiv_id = ? AND settings = ?", (arxiv_id, settings))
+            total -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            conn = self._connect()
+            try:
+                entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM papers").fetchone()
+            finally:
+                conn.close()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": total,
+        }
+
+
+chunk_store = ChunkStore()
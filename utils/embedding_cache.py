@@ -0,0 +1,179 @@
+# utils/embedding_cache.py
+"""
+Кэш эмбеддингов чанков на диске.
+Ключ — хеш текста чанка; отдельная папка на каждую модель. Векторы (нормированные, float32)
+дописываются в один файл vectors.f32 и читаются через np.memmap, соответствие
+хеш → номер строки хранится в SQLite. Номер строки служит стабильным ID чанка в FAISS.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from config import EMBEDDING_CACHE_DIR
+from utils.file_lock import file_lock
+from utils.instrumentation import count
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def normalize(vectors) -> np.ndarray:
+    """L2-нормировка: после неё скалярное произведение = косинусная близость."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class EmbeddingCache:
+    def __init__(self, model_name: str, root: str = EMBEDDING_CACHE_DIR):
+        self.model_name = model_name
+        self.dir = os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name))
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.db_path = os.path.join(self.dir, "index.sqlite")
+        self.lock_path = os.path.join(self.dir, ".lock")
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dim = None
+        self._memmap = None
+        self._flight = SingleFlight("embedding")
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(self.dir, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("CREATE TABLE IF NOT EXISTS rows (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        return conn
+
+    @property
+    def dim(self):
+        if self._dim is None:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+            finally:
+                conn.close()
+            self._dim = int(row[0]) if row else None
+        return self._dim
+
+    def _lookup(self, conn: sqlite3.Connection, hashes: list) -> dict:
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            found.update(conn.execute(
+                f"SELECT hash, row FROM rows WHERE hash IN ({placeholders})", batch
+            ).fetchall())
+        return found
+
+    def embed(self, texts: list, embed_fn) -> np.ndarray:
+        """
+        Возвращает ID (номера строк) для каждого текста. Через embed_fn (например,
+        embedding_model.embed_documents) пропускаются только тексты, которых ещё нет в кэше.
+        """
+        hashes = [content_hash(t) for t in texts]
+        conn = self._connect()
+        try:
+            known = self._lookup(conn, hashes)
+        finally:
+            conn.close()
+
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in known and h not in missing:
+                missing[h] = text
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        count("embedding_cache_hits", len(texts) - len(missing))
+        count("embedding_cache_misses", len(missing))
+
+        # Чанки, которые прямо сейчас эмбеддит другой поток, не считаем повторно — ждём его результат
+        own, shared = self._flight.claim(missing)
+        if own:
+            logger.info(f"🧮 Эмбеддинги: {len(own)} новых чанков, {len(texts) - len(missing)} из кэша")
+            try:
+                vectors = normalize(embed_fn([missing[h] for h in own]))
+                rows = self._append(list(own), vectors)
+            except BaseException as e:
+                self._flight.release(own, error=e)
+                raise
+            self._flight.release(own, rows)
+            known.update(rows)
+        for h, future in shared.items():
+            known[h] = future.result()
+
+        return np.array([known[h] for h in hashes], dtype=np.int64)
+
+    def _append(self, hashes: list, vectors: np.ndarray) -> dict:
+        """Дописывает векторы в конец файла под межпроцессной блокировкой."""
+        with file_lock(self.lock_path):
+            conn = self._connect()
+            try:
+                # Пока мы считали эмбеддинги, другой процесс мог добавить те же тексты
+                known = self._lookup(conn, hashes)
+                todo = [i for i, h in enumerate(hashes) if h not in known]
+                if todo:
+                    dim = vectors.shape[1]
+                    if self.dim is None:
+                        conn.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(dim),))
+                        conn.execute("INSERT OR REPLACE INTO meta VALUES ('model', ?)", (self.model_name,))
+                        self._dim = dim
+                    size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+                    first_row = size // (dim * 4)
+                    with open(self.vectors_path, "ab") as f:
+                        f.truncate(first_row * dim * 4)  # обрезаем недописанный хвост после сбоя
+                        f.write(np.ascontiguousarray(vectors[todo]).tobytes())
+                    rows = {hashes[i]: first_row + n for n, i in enumerate(todo)}
+                    conn.executemany("INSERT INTO rows VALUES (?, ?)", list(rows.items()))
+                    conn.commit()
+                    known.update(rows)
+            finally:
+                conn.close()
+        return known
+
+    def ids(self) -> np.ndarray:
+        """ID всех векторов в кэше."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT row FROM rows ORDER BY row").fetchall()
+        finally:
+            conn.close()
+        return np.array([row for (row,) in rows], dtype=np.int64)
+
+    def __len__(self):
+        """Число строк в vectors.f32, закреплённых за текстами: ID — от 0 до len - 1."""
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM rows").fetchone()[0]
+        finally:
+            conn.close()
+
+    def vectors(self, ids) -> np.ndarray:
+        """Векторы по ID, читаются из memory-mapped файла."""
+        ids = np.asarray(ids, dtype=np.int64)
+        n_rows = os.path.getsize(self.vectors_path) // (self.dim * 4)
+        with self._lock:
+            if self._memmap is None or self._memmap.shape[0] < n_rows:
+                self._memmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n_rows, self.dim))
+            memmap = self._memmap
+        return np.asarray(memmap[ids])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
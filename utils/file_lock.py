@@ -0,0 +1,70 @@
+# utils/file_lock.py
+"""
+Межпроцессная блокировка через lock-файл (flock). Нужна кэшам, которые
+одновременно пишут несколько Streamlit-сессий и рабочих процессов.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: только блокировка внутри процесса
+    fcntl = None
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(path: str) -> threading.Lock:
+    with _thread_locks_guard:
+        if path not in _thread_locks:
+            _thread_locks[path] = threading.Lock()
+        return _thread_locks[path]
+
+
+@contextmanager
+def file_lock(path: str):
+    """Эксклюзивная блокировка по пути lock-файла: и между потоками, и между процессами."""
+    path = os.path.abspath(path)
+    with _thread_lock(path):
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def transient_file_lock(path: str):
+    """
+    Межпроцессная блокировка через lock-файл, который удаляется при выходе: файлов не копится
+    по одному на ключ. Без блокировки между потоками — потоки процесса разводит вызывающий код
+    (например, SingleFlight). Кто дождался блокировки уже удалённого файла, пробует заново.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    while True:
+        f = open(path, "a")
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    try:
+        yield
+    finally:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        f.close()
@@ -0,0 +1,171 @@
+# utils/instrumentation.py
+"""
+Инструментирование узлов графа.
+instrument() оборачивает узел: меряет время, считает элементы на выходе (статьи, чанки,
+гипотезы, доказательства) и собирает счётчики, которые код внутри узла отправляет через count()
+(запросы к LLM, токены, скачанные байты, попадания/промахи кэшей). Всё складывается в state["metrics"].
+invoke_traced() запускает граф и пишет один трейс на прогон — JSON lines или Prometheus text.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from config import LOG_LEVEL, TRACE_FORMAT, TRACE_PATH
+
+logger = logging.getLogger(__name__)
+
+
+class NodeCounters:
+    """Счётчики одного запуска узла; пополняются из любых потоков."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}
+
+    def add(self, name: str, value=1):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+
+_current = contextvars.ContextVar("node_counters", default=None)
+
+
+def count(name: str, value=1):
+    """Увеличивает счётчик текущего узла. Вне инструментированного узла ничего не делает."""
+    counters = _current.get()
+    if counters is not None:
+        counters.add(name, value)
+
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit с копией контекста: count() из рабочего потока попадёт в счётчики узла."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def _item_counts(update: dict) -> dict:
+    counts = {}
+    if "papers" in update:
+        counts["papers"] = len(update["papers"])
+    if "chunks_with_metadata" in update:
+        counts["chunks"] = len(update["chunks_with_metadata"])
+    if "hypotheses" in update:
+        counts["hypotheses"] = len(update["hypotheses"])
+    if "evidence" in update:
+        counts["evidence_items"] = len(update["evidence"])
+        counts["evidence_chunks"] = sum(
+            len(item.get("validated_chunks", item.get("chunks", []))) for item in update["evidence"]
+        )
+    return counts
+
+
+def instrument(name: str, node):
+    """Оборачивает узел графа: время, число элементов и счётчики → update["metrics"][name]."""
+
+    @functools.wraps(node)
+    def wrapper(state):
+        counters = NodeCounters()
+        token = _current.set(counters)
+        started = time.perf_counter()
+        try:
+            update = node(state)
+        finally:
+            _current.reset(token)
+        update = dict(update or {})
+        record = {"wall_s": round(time.perf_counter() - started, 4)}
+        record.update(_item_counts(update))
+        record.update(counters.values)
+        update["metrics"] = {name: record}
+        logger.debug(f"⏱️ {name}: {record}")
+        return update
+
+    return wrapper
+
+
+def merge_metrics(left: dict, right: dict) -> dict:
+    """Редьюсер для state["metrics"]: при повторном запуске узла числа складываются."""
+    merged = dict(left or {})
+    for node, record in (right or {}).items():
+        if node not in merged:
+            merged[node] = dict(record)
+            continue
+        combined = dict(merged[node])
+        for key, value in record.items():
+            if isinstance(value, (int, float)) and isinstance(combined.get(key), (int, float)):
+                combined[key] = combined[key] + value
+            else:
+                combined[key] = value
+        merged[node] = combined
+    return merged
+
+
+def _prometheus(trace: dict) -> str:
+    lines = [
+        "# TYPE research_assistant_run_seconds gauge",
+        f'research_assistant_run_seconds{{run_id="{trace["run_id"]}"}} {trace["total_s"]}',
+    ]
+    metric_names = sorted({key for record in trace["nodes"].values() for key in record})
+    for metric in metric_names:
+        lines.append(f"# TYPE research_assistant_node_{metric} gauge")
+        for node, record in trace["nodes"].items():
+            value = record.get(metric)
+            if isinstance(value, (int, float)):
+                lines.append(f'research_assistant_node_{metric}{{node="{node}",run_id="{trace["run_id"]}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def write_trace(trace: dict, fmt: str = TRACE_FORMAT, path: str = TRACE_PATH):
+    """jsonl — дописывает строку в файл; prometheus — перезаписывает файл (textfile collector); none — ничего."""
+    if fmt == "none" or not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if fmt == "prometheus":
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(_prometheus(trace))
+        os.replace(tmp_path, path)
+    else:
+        with open(path, "a") as f:
+            f.write(json.dumps(trace, ensure_ascii=False) + "\n")
+
+
+def make_trace(question: str, metrics: dict, started: float) -> dict:
+    """Трейс прогона: метрики узлов из state["metrics"], started — time.perf_counter() на старте."""
+    return {
+        "run_id": uuid.uuid4().hex,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "question": question,
+        "total_s": round(time.perf_counter() - started, 4),
+        "nodes": metrics or {},
+    }
+
+
+def invoke_traced(graph_app, initial_state: dict, config: dict = None):
+    """app.invoke + один структурированный трейс на прогон. Возвращает (final_state, trace)."""
+    started = time.perf_counter()
+    final_state = graph_app.invoke(initial_state, config=config)
+    trace = make_trace(initial_state.get("question"), final_state.get("metrics", {}), started)
+    write_trace(trace)
+    return final_state, trace
+
+
+# Логгеры пайплайна (logging.getLogger(__name__) в его модулях); "__main__" — batch.py / server.py как скрипт
+PIPELINE_LOGGERS = ("nodes", "utils", "benchmarks", "graph", "batch", "server", "__main__")
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    """
+    Уровень логов пайплайна: DEBUG / INFO / WARNING / ERROR; OFF — выключить.
+    OFF глушит только логгеры пайплайна: логи uvicorn и Streamlit остаются.
+    """
+    off = level.upper() == "OFF"
+    for name in PIPELINE_LOGGERS:
+        logging.getLogger(name).setLevel(logging.CRITICAL + 1 if off else logging.NOTSET)
+    if off:
+        return
+    logging.basicConfig(level=level.upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
@@ -0,0 +1,248 @@
+# utils/llm_cache.py
+"""
+Кэш ответов LLM на диске (SQLite).
+Ключ — модель + хеш шаблона промпта + нормализованные входы. Записи живут LLM_CACHE_TTL секунд,
+при превышении LLM_CACHE_MAX_BYTES вытесняются давно не использованные (LRU).
+SQLite в режиме WAL: один файл безопасно делят Streamlit-сессии и рабочие процессы.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.messages import AIMessage
+
+from config import LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_BYTES
+from utils.instrumentation import count
+
+
+def _normalize(value):
+    """Схлопывает пробелы и регистр: почти одинаковые вопросы дают один ключ."""
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+# Ключей в одном SELECT ... IN (...): ниже лимита параметров SQLite
+LOOKUP_CHUNK = 500
+
+
+def template_hash(prompt) -> str:
+    return hashlib.sha256(prompt.pretty_repr().encode()).hexdigest()[:16]
+
+
+class LLMCache:
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl: int = LLM_CACHE_TTL,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES, enabled: bool = LLM_CACHE_ENABLED):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    usage TEXT,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+            # Счётчики общие для всех процессов
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def key(self, model: str, prompt, inputs: dict) -> str:
+        payload = json.dumps(
+            {"model": model, "template": template_hash(prompt), "inputs": _normalize(inputs)},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str):
+        """AIMessage из кэша (response_metadata["cached"] = True) или None."""
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: list) -> list:
+        """
+        Пакетный get: все ключи — одним соединением и SELECT ... IN, last_access и общие счётчики
+        обновляются одной транзакцией на пакет. Возвращает список той же длины (None — промах).
+        """
+        if not self.enabled or not keys:
+            return [None] * len(keys)
+        now = time.time()
+        unique = list(dict.fromkeys(keys))
+        rows = {}
+        with self._lock:
+            conn = self._connect()
+            try:
+                for start in range(0, len(unique), LOOKUP_CHUNK):
+                    part = unique[start:start + LOOKUP_CHUNK]
+                    rows.update(
+                        (key, (content, usage)) for key, content, usage in conn.execute(
+                            f"SELECT key, content, usage FROM responses "
+                            f"WHERE created > ? AND key IN ({','.join('?' * len(part))})",
+                            (now - self.ttl, *part)
+                        )
+                    )
+                hits = sum(1 for key in keys if key in rows)
+                misses = len(keys) - hits
+                if rows:
+                    conn.executemany("UPDATE responses SET last_access = ? WHERE key = ?",
+                                     [(now, key) for key in rows])
+                conn.executemany("UPDATE counters SET value = value + ? WHERE name = ?",
+                                 [(hits, "hits"), (misses, "misses")])
+                conn.commit()
+            finally:
+                conn.close()
+            self.hits += hits
+            self.misses += misses
+        if hits:
+            count("llm_cache_hits", hits)
+        if misses:
+            count("llm_cache_misses", misses)
+        return [
+            AIMessage(
+                content=rows[key][0],
+                response_metadata={"cached": True, "original_usage": json.loads(rows[key][1]) if rows[key][1] else None}
+            ) if key in rows else None
+            for key in keys
+        ]
+
+    def put(self, key: str, model: str, message):
+        self.put_many(model, [(key, message)])
+
+    def put_many(self, model: str, items: list):
+        """Сохраняет пары (ключ, AIMessage) одной транзакцией с одним проходом вытеснения."""
+        if not self.enabled or not items:
+            return
+        now = time.time()
+        rows = [
+            (key, model, message.content,
+             json.dumps(message.usage_metadata) if message.usage_metadata else None,
+             len(message.content.encode()) + len(key), now, now)
+            for key, message in items
+        ]
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+
+    def stats(self) -> dict:
+        """Счётчики этого процесса и общие (по всем процессам, из SQLite)."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                shared = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+                entries, total = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+            finally:
+                conn.close()
+        lookups = self.hits + self.misses
+        shared_lookups = shared["hits"] + shared["misses"]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "shared_hit_rate": shared["hits"] / shared_lookups if shared_lookups else 0.0,
+            "entries": entries,
+            "bytes": total,
+        }
+
+
+llm_cache = LLMCache()
+
+
+def _model_name(llm) -> str:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+def _count_usage(message):
+    """Реальные (не из кэша) запросы к LLM и их токены — в счётчики узла."""
+    if isinstance(message, Exception):
+        count("llm_errors")
+        return
+    count("llm_calls")
+    usage = message.usage_metadata or {}
+    count("input_tokens", usage.get("input_tokens", 0))
+    count("output_tokens", usage.get("output_tokens", 0))
+
+
+def cached_invoke(prompt, llm, chain, inputs: dict, should_cache=None):
+    """
+    chain.invoke(inputs) через кэш. chain должен возвращать AIMessage (prompt | llm ...).
+    should_cache(message) решает, сохранять ли ответ (например, только разбираемый).
+    """
+    model = _model_name(llm)
+    key = llm_cache.key(model, prompt, inputs)
+    cached = llm_cache.get(key)
+    if cached is not None:
+        return cached
+    message = chain.invoke(inputs)
+    _count_usage(message)
+    if should_cache is None or should_cache(message):
+        llm_cache.put(key, model, message)
+    return message
+
+
+async def cached_abatch(prompt, llm, chain, inputs: list, config=None, should_cache=None) -> list:
+    """
+    chain.abatch(inputs) через кэш: в LLM уходят только промахи. Порядок и исключения — как у abatch.
+    Чтение и запись кэша — по одному обращению к SQLite на пакет, в потоке, чтобы не блокировать event loop.
+    should_cache(message, i) решает, сохранять ли ответ на inputs[i].
+    """
+    model = _model_name(llm)
+    keys = [llm_cache.key(model, prompt, item) for item in inputs]
+    results = await asyncio.to_thread(llm_cache.get_many, keys)
+    todo = [i for i, result in enumerate(results) if result is None]
+    if todo:
+        fresh = await chain.abatch([inputs[i] for i in todo], config=config, return_exceptions=True)
+        to_store = []
+        for i, message in zip(todo, fresh):
+            results[i] = message
+            _count_usage(message)
+            if not isinstance(message, Exception) and (should_cache is None or should_cache(message, i)):
+                to_store.append((keys[i], message))
+        if to_store:
+            await asyncio.to_thread(llm_cache.put_many, model, to_store)
+    return results
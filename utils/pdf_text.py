@@ -0,0 +1,162 @@
+# utils/pdf_text.py
+"""
+CPU-часть обработки PDF: pypdf → проверки → чанки с метаданными.
+Функции верхнего уровня, чтобы их можно было запускать в ProcessPoolExecutor.
+"""
+import logging
+import mmap
+import re
+from bisect import bisect_right
+
+from pypdf import PdfReader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from config import CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_SEPARATORS, PDF_MAX_PAGES
+
+logger = logging.getLogger(__name__)
+
+STRUCTURE_KEYWORDS = ["abstract", "introduction", "method", "experiment", "results", "conclusion"]
+TECH_TERMS = ["attention", "kv cache", "quantization", "layer", "embedding", "model", "inference"]
+
+# Флаги метаданных чанка → ключевые слова (подстроки в тексте чанка в нижнем регистре)
+KEYWORD_FLAGS = {
+    "contains_method": ["method", "algorithm", "approach"],
+    "contains_results": ["result", "accuracy", "throughput", "memory", "table", "figure"],
+    "contains_experiment": ["experiment", "benchmark", "evaluation", "dataset"],
+    "contains_figures": ["figure", "table"],
+}
+# Один проход по чанку: lookahead находит вхождения всех ключевых слов, в том числе перекрывающиеся
+_ALL_KEYWORDS = sorted({kw for kws in KEYWORD_FLAGS.values() for kw in kws}, key=len, reverse=True)
+_KEYWORD_PATTERN = re.compile("(?=(" + "|".join(re.escape(kw) for kw in _ALL_KEYWORDS) + "))")
+
+# Меняется при любом изменении логики разбора/метаданных — старые записи в хранилище чанков становятся невалидными
+PIPELINE_VERSION = "3"
+
+
+def keyword_flags(chunk: str) -> dict:
+    found = set(_KEYWORD_PATTERN.findall(chunk.lower()))
+    return {flag: any(kw in found for kw in kws) for flag, kws in KEYWORD_FLAGS.items()}
+
+
+def iter_page_texts(reader: PdfReader, max_pages: int = 0):
+    """Текст PDF по одной странице; pypdf разбирает страницы лениво. max_pages=0 — без ограничения."""
+    for i, page in enumerate(reader.pages):
+        if max_pages and i >= max_pages:
+            logger.info(f"✂️ Обрезаем PDF до {max_pages} страниц")
+            break
+        yield (page.extract_text() or "") + "\n"
+
+
+class StreamingChunker:
+    """
+    Кормит splitter текстом порциями: держит в памяти только окно последних страниц.
+    Последний чанк окна не отдаётся, а остаётся началом следующего окна — текст на границе
+    не теряется, но разрез возле неё может немного отличаться от разбиения всего текста сразу.
+    """
+
+    def __init__(self, splitter: RecursiveCharacterTextSplitter, window: int):
+        self.splitter = splitter
+        self.window = window
+        self.buffer = ""
+        self.base = 0  # смещение начала buffer в тексте документа
+
+    def _split(self):
+        documents = self.splitter.create_documents([self.buffer])
+        return [(d.page_content, d.metadata.get("start_index", -1)) for d in documents]
+
+    def _absolute(self, chunks):
+        return [(text, self.base + start if start >= 0 else -1) for text, start in chunks]
+
+    def feed(self, text: str) -> list:
+        """Добавляет текст; возвращает готовые чанки [(текст, смещение в документе)]."""
+        self.buffer += text
+        if len(self.buffer) < self.window:
+            return []
+        chunks = self._split()
+        keep = chunks[-1][1] if len(chunks) > 1 else -1
+        if keep <= 0:
+            return []
+        ready = self._absolute(chunks[:-1])
+        self.buffer = self.buffer[keep:]
+        self.base += keep
+        return ready
+
+    def flush(self) -> list:
+        ready = self._absolute(self._split()) if self.buffer.strip() else []
+        self.buffer = ""
+        return ready
+
+
+def process_pdf(path: str, title: str, chunk_size: int = CHUNK_SIZE,
+                chunk_overlap: int = CHUNK_OVERLAP, separators: list = CHUNK_SEPARATORS,
+                max_pages: int = PDF_MAX_PAGES) -> dict:
+    """
+    Разбирает скачанный PDF и режет его на чанки.
+    Файл открывается через mmap (pypdf не копирует его в память целиком), текст идёт
+    постранично в StreamingChunker; читается не больше max_pages страниц. Полный текст
+    не собирается: в памяти — окно чанкера, начало документа для проверки структуры и готовые чанки.
+    Возвращает {"status": "ok" | "no_structure" | "no_tech", "chunks": [...]}.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        splitter = RecursiveCharacterTextSplitter(
+            separators=separators,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            add_start_index=True  # смещение чанка ищется от предыдущего, без квадратичного find
+        )
+        chunker = StreamingChunker(splitter, window=max(20 * chunk_size, 20000))
+        return _process_pages(iter_page_texts(PdfReader(data), max_pages), title, chunker)
+
+
+def _with_metadata(raw_chunks: list, title: str, page_starts: list, page: int) -> tuple:
+    """Чанки [(текст, смещение)] → chunks_with_metadata; page — страница предыдущего чанка."""
+    chunks = []
+    for text, start in raw_chunks:
+        if start >= 0:
+            page = bisect_right(page_starts, start)  # номер страницы, с которой начинается чанк (с 1)
+        metadata = {"source_title": title}
+        metadata.update(keyword_flags(text))
+        metadata["page_estimate"] = page
+        chunks.append({
+            "text": text,
+            "metadata": metadata
+        })
+    return chunks, page
+
+
+def _process_pages(page_texts, title: str, chunker: StreamingChunker) -> dict:
+    page_starts = []  # смещение начала каждой страницы в тексте документа
+    offset = 0
+    head = ""         # первые ~1000 символов очищенного текста — для проверки структуры
+    structure_checked = False
+    has_tech = False
+    chunks_with_metadata = []
+    page = 1
+
+    for page_text in page_texts:
+        page_starts.append(offset)
+        offset += len(page_text)
+
+        # 🔍 Проверяем, что это реальная статья — по мере чтения, без склейки всего текста
+        clean_page = re.sub(r'\s+', ' ', page_text).strip().lower()
+        has_tech = has_tech or any(term in clean_page for term in TECH_TERMS)
+        if not structure_checked and clean_page:
+            head = f"{head} {clean_page}".strip()[:1000]
+            if len(head) >= 1000:
+                structure_checked = True
+                if not any(kw in head for kw in STRUCTURE_KEYWORDS):
+                    return {"status": "no_structure", "chunks": []}
+
+        # 🔥 Разбиваем на чанки по мере поступления страниц
+        ready, page = _with_metadata(chunker.feed(page_text), title, page_starts, page)
+        chunks_with_metadata.extend(ready)
+
+    if not structure_checked and not any(kw in head for kw in STRUCTURE_KEYWORDS):
+        return {"status": "no_structure", "chunks": []}
+
+    if not has_tech:
+        return {"status": "no_tech", "chunks": []}
+
+    ready, page = _with_metadata(chunker.flush(), title, page_starts, page)
+    chunks_with_metadata.extend(ready)
+    return {"status": "ok", "chunks": chunks_with_metadata}
@@ -0,0 +1,124 @@
+# utils/resources.py
+"""
+Реестр тяжёлых ресурсов: модель эмбеддингов и LLM-клиент.
+Ничего не загружается при импорте — ресурс создаётся при первом get() и дальше
+один экземпляр делится всеми сессиями Streamlit и потоками процесса.
+prewarm() может загрузить всё заранее в фоне; timings() показывает, сколько это стоило.
+"""
+import logging
+import os
+import threading
+import time
+
+from config import (
+    EMBEDDING_MODEL, JUDGE_MAX_CONCURRENCY, LLM_REQUESTS_PER_SECOND, LLM_MAX_RETRIES,
+    LLM_MODEL, LLM_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+_factories = {}
+_instances = {}
+_locks = {}
+_timings = {}
+_guard = threading.Lock()
+
+
+def register(name: str, factory):
+    """Регистрирует фабрику ресурса (вызывается один раз, при первом get)."""
+    with _guard:
+        _factories[name] = factory
+        _locks.setdefault(name, threading.Lock())
+
+
+def get(name: str):
+    """Экземпляр ресурса; первый вызов создаёт его, параллельные вызовы ждут того же экземпляра."""
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _locks[name]:
+        if name not in _instances:
+            started = time.perf_counter()
+            _instances[name] = _factories[name]()
+            _timings[name] = round(time.perf_counter() - started, 3)
+            logger.info(f"⚙️ Ресурс '{name}' загружен за {_timings[name]:.1f} с")
+        return _instances[name]
+
+
+def override(name: str, instance):
+    """Подменяет ресурс готовым объектом (бенчмарки, фейковые модели)."""
+    with _guard:
+        _locks.setdefault(name, threading.Lock())
+    with _locks[name]:
+        _instances[name] = instance
+        _timings[name] = 0.0
+
+
+def is_loaded(name: str) -> bool:
+    return name in _instances
+
+
+def timings() -> dict:
+    """Сколько секунд заняла загрузка каждого ресурса (только уже загруженные)."""
+    return dict(_timings)
+
+
+def prewarm(names=None, background: bool = True):
+    """Загружает ресурсы заранее; в фоне — чтобы не блокировать первый рендер Streamlit."""
+    names = list(names or _factories)
+
+    def _load():
+        for name in names:
+            try:
+                get(name)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось прогреть '{name}': {e}")
+
+    if not background:
+        _load()
+        return None
+    thread = threading.Thread(target=_load, name="resources-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+
+def with_llm_retry(runnable):
+    """429, 5xx и сетевые сбои — повторяем с экспоненциальной задержкой и джиттером."""
+    import openai
+    return runnable.with_retry(
+        retry_if_exception_type=(openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError),
+        wait_exponential_jitter=True,
+        stop_after_attempt=LLM_MAX_RETRIES + 1
+    )
+
+
+# === Фабрики ===
+
+def _embedding_model():
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+
+
+def _llm():
+    from langchain_core.rate_limiters import InMemoryRateLimiter
+    from langchain_openai import ChatOpenAI
+
+    # Token bucket: не больше LLM_REQUESTS_PER_SECOND запросов в секунду, всплеск — до JUDGE_MAX_CONCURRENCY.
+    # Один клиент (и один лимит) на процесс — и для гипотез, и для судьи.
+    rate_limiter = InMemoryRateLimiter(
+        requests_per_second=LLM_REQUESTS_PER_SECOND,
+        check_every_n_seconds=0.05,
+        max_bucket_size=JUDGE_MAX_CONCURRENCY
+    )
+    return ChatOpenAI(
+        base_url="https://openrouter.ai/api/v1",
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        model=LLM_MODEL,
+        timeout=LLM_TIMEOUT,
+        max_retries=0,  # повторы — через with_llm_retry
+        rate_limiter=rate_limiter
+    )
+
+
+register("embedding_model", _embedding_model)
+register("llm", _llm)
@@ -0,0 +1,83 @@
+# utils/singleflight.py
+"""
+Single-flight внутри процесса: если одну и ту же работу (скачать статью, разобрать PDF,
+посчитать эмбеддинг чанка) одновременно просят несколько запросов, её делает первый,
+а остальные ждут его результата. Нужен пакетному режиму, где вопросы идут параллельно
+и часто находят одни и те же статьи. Между процессами дублирование гасят файловые блокировки.
+"""
+import threading
+from concurrent.futures import CancelledError, Future
+
+from utils.instrumentation import count
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def claim(self, keys) -> tuple:
+        """
+        Для пакетной работы. Возвращает (own, shared): own — ключи, которые считает этот вызов
+        (обязательно завершить через release), shared — Future ключей, которые уже кто-то считает.
+        """
+        own, shared = {}, {}
+        with self._lock:
+            for key in keys:
+                if key in self._futures:
+                    shared[key] = self._futures[key]
+                elif key not in own:
+                    own[key] = self._futures[key] = Future()
+        if shared:
+            count(f"{self.name}_shared", len(shared))
+        return own, shared
+
+    def release(self, own: dict, results: dict = None, error: BaseException = None):
+        """Публикует результаты (или ошибку) для ключей из claim и снимает их с учёта."""
+        with self._lock:
+            for key in own:
+                self._futures.pop(key, None)
+        for key, future in own.items():
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result((results or {}).get(key))
+
+    def do(self, key, fn, *args, **kwargs):
+        """Синхронно: первый вызов выполняет fn, параллельные с тем же ключом получают его результат."""
+        own, shared = self.claim([key])
+        if key in shared:
+            return shared[key].result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.release(own, error=e)
+            raise
+        self.release(own, {key: result})
+        return result
+
+    def future(self, key, start) -> Future:
+        """
+        Асинхронно: start() запускает работу и возвращает Future (например, executor.submit).
+        Параллельные вызовы с тем же ключом получают общий Future и start() не вызывают.
+        """
+        own, shared = self.claim([key])
+        if key in shared:
+            return shared[key]
+        try:
+            inner = start()
+        except BaseException as e:
+            self.release(own, error=e)
+            raise
+
+        def _done(finished: Future):
+            if finished.cancelled():
+                self.release(own, error=CancelledError())
+            elif finished.exception() is not None:
+                self.release(own, error=finished.exception())
+            else:
+                self.release(own, {key: finished.result()})
+
+        inner.add_done_callback(_done)
+        return own[key]
@@ -0,0 +1,296 @@
+# utils/vector_index.py
+"""
+Поиск ближайших векторов поверх кэша эмбеддингов.
+Бэкенд flat — точный поиск прямо по vectors.f32 (memmap): кэш и есть индекс, отдельной копии
+векторов в памяти или на диске нет, новые векторы ничего не переписывают.
+
+Квантованные бэкенды (INDEX_BACKEND): sq8 — скалярное квантование в int8 (в 4 раза меньше памяти);
+ivfpq — IVF со сжатием PQ (в десятки раз меньше, поиск по nprobe кластерам). Индекс — это
+сегменты index-<backend>-<первый ID>-<конец>.faiss, коды которых отображаются из файла на месте
+(IO_FLAG_MMAP_IFC): процессы-воркеры делят одни страницы в page cache. Обучение (долгое для ivfpq)
+идёт офлайн (benchmarks.index_backends --build) или в фоновом потоке, но никогда внутри запроса.
+Векторы, ещё не попавшие в сегменты («хвост»), ищутся точно по кэшу; когда их набирается
+INDEX_MERGE_TAIL, фоновый поток дописывает их новым сегментом по обученному шаблону,
+не читая существующие сегменты. Кандидаты из сегментов и хвоста переоцениваются точным
+косинусом, поэтому score — всегда косинусная близость. --build сливает сегменты в один.
+
+Сегменты нужны только поиску по всему корпусу (subset=None). Чанки одного запроса — это
+тысячи векторов: их точный перебор по memmap дешевле, чем фильтр IDSelector по всему
+квантованному индексу с последующей переоценкой тех же векторов.
+"""
+import logging
+import os
+import re
+import threading
+
+import faiss
+import numpy as np
+
+from config import (
+    INDEX_BACKEND, INDEX_TRAIN_MIN, INDEX_TRAIN_SAMPLE, INDEX_NLIST, INDEX_PQ_M, INDEX_NPROBE,
+    INDEX_MMAP, INDEX_MERGE_TAIL, INDEX_AUTO_BUILD
+)
+from utils.embedding_cache import EmbeddingCache
+from utils.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+INDEX_BACKENDS = ["flat", "sq8", "ivfpq"]
+ADD_BATCH = 65536
+SEGMENT_PATTERN = re.compile(r"^index-(\w+)-(\d{12})-(\d{12})\.faiss$")
+
+
+def _pq_m(dim: int, m: int) -> int:
+    """Число подпространств PQ должно делить размерность."""
+    while dim % m:
+        m -= 1
+    return m
+
+
+def new_index(backend: str, dim: int, n_vectors: int = 0):
+    """Пустой индекс по косинусу (векторы нормированы). ivfpq: nlist ≈ 4·√N, не больше N/39."""
+    if backend == "sq8":
+        return faiss.index_factory(dim, "IDMap2,SQ8", faiss.METRIC_INNER_PRODUCT)
+    if backend == "ivfpq":
+        nlist = INDEX_NLIST or int(4 * np.sqrt(max(n_vectors, 1)))
+        nlist = max(1, min(nlist, n_vectors // 39 or 1))
+        return faiss.index_factory(dim, f"IVF{nlist},PQ{_pq_m(dim, INDEX_PQ_M)}", faiss.METRIC_INNER_PRODUCT)
+    return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+
+def train_index(backend: str, ids: np.ndarray, get_vectors, dim: int, train_sample: int = INDEX_TRAIN_SAMPLE):
+    """Пустой обученный индекс: обучение на случайной выборке из ids."""
+    ids = np.asarray(ids, dtype=np.int64)
+    index = new_index(backend, dim, len(ids))
+    if not index.is_trained:
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(ids, size=min(train_sample, len(ids)), replace=False))
+        index.train(get_vectors(sample))
+    return index
+
+
+def add_vectors(index, ids: np.ndarray, get_vectors):
+    ids = np.asarray(ids, dtype=np.int64)
+    for start in range(0, len(ids), ADD_BATCH):
+        batch = ids[start:start + ADD_BATCH]
+        index.add_with_ids(get_vectors(batch), batch)
+    return index
+
+
+def build_index(backend: str, ids: np.ndarray, get_vectors, dim: int, train_sample: int = INDEX_TRAIN_SAMPLE):
+    """Индекс с нуля: обучение на случайной выборке, затем добавление всех векторов пачками."""
+    return add_vectors(train_index(backend, ids, get_vectors, dim, train_sample), ids, get_vectors)
+
+
+def read_index(path: str, mmap: bool = INDEX_MMAP):
+    """
+    IO_FLAG_MMAP_IFC — коды индекса читаются прямо из отображённого файла, без копии в память
+    процесса (общие страницы page cache). Старые faiss без него — IO_FLAG_MMAP, который отображает
+    лишь часть структур; если и это не вышло — обычная загрузка в память.
+    """
+    if mmap:
+        flags = [faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY]
+        if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+            flags.insert(0, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        for flag in flags:
+            try:
+                return faiss.read_index(path, flag)
+            except RuntimeError as e:
+                error = e
+        logger.warning(f"⚠️ Индекс не открылся через mmap, читаем в память: {error}")
+    return faiss.read_index(path)
+
+
+def search_params(index, selector=None, nprobe: int = INDEX_NPROBE):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    return faiss.SearchParameters(sel=selector) if selector is not None else None
+
+
+def _write_index(index, path: str):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class VectorIndex:
+    def __init__(self, cache: EmbeddingCache, backend: str = INDEX_BACKEND):
+        self.cache = cache
+        self.backend = backend if backend in INDEX_BACKENDS else "flat"
+        self.lock_path = os.path.join(cache.dir, ".index.lock")
+        self._lock = threading.Lock()
+        self._segments = {}  # имя файла сегмента → открытый (mmap) индекс
+        self._merging = False
+
+    def _template_path(self, backend: str) -> str:
+        return os.path.join(self.cache.dir, f"index-{backend}.trained.faiss")
+
+    def _segment_path(self, backend: str, start: int, end: int) -> str:
+        return os.path.join(self.cache.dir, f"index-{backend}-{start:012d}-{end:012d}.faiss")
+
+    def _segment_files(self, backend: str) -> list:
+        if not os.path.isdir(self.cache.dir):
+            return []
+        found = []
+        for name in os.listdir(self.cache.dir):
+            match = SEGMENT_PATTERN.match(name)
+            if match and match.group(1) == backend:
+                found.append((int(match.group(2)), int(match.group(3)), name))
+        return found
+
+    def _chain(self) -> tuple:
+        """
+        Сегменты, подряд покрывающие ID с нуля: ([(начало, конец, имя)], первый непокрытый ID).
+        Пока --build заменяет сегменты, старые и новый могут лежать рядом — берётся самый длинный.
+        """
+        found = self._segment_files(self.backend) if self.backend != "flat" else []
+        chain, covered = [], 0
+        while True:
+            following = [segment for segment in found if segment[0] == covered and segment[1] > covered]
+            if not following:
+                return chain, covered
+            segment = max(following, key=lambda s: s[1])
+            chain.append(segment)
+            covered = segment[1]
+
+    def _open(self) -> tuple:
+        """Открытые сегменты и первый непокрытый ID; новые сегменты других процессов подхватываются."""
+        with self._lock:
+            chain, covered = self._chain()
+            opened = {}
+            for _, _, name in chain:
+                index = self._segments.get(name)
+                opened[name] = index if index is not None else read_index(os.path.join(self.cache.dir, name))
+            self._segments = opened
+            return list(opened.values()), covered
+
+    def sync(self):
+        """
+        Вызывается после добавления векторов в кэш эмбеддингов. Сами векторы уже на диске и сразу
+        ищутся точно; если хвост вне сегментов дорос до INDEX_MERGE_TAIL (или пора обучить первый
+        индекс), фоновый поток дописывает сегмент. Запрос его не ждёт.
+        """
+        if self.backend == "flat":
+            return
+        with self._lock:
+            if self._merging:
+                return
+            chain, covered = self._chain()
+            tail = len(self.cache) - covered
+            if chain:
+                needed = tail >= INDEX_MERGE_TAIL
+            else:
+                needed = INDEX_AUTO_BUILD and tail >= INDEX_TRAIN_MIN
+            if not needed:
+                return
+            self._merging = True
+        threading.Thread(target=self._merge, name="vector-index-merge", daemon=True).start()
+
+    def _merge(self):
+        try:
+            with file_lock(self.lock_path):
+                # Пока ждали блокировку, сегмент мог дописать другой процесс
+                chain, covered = self._chain()
+                total = len(self.cache)
+                if not chain or not os.path.exists(self._template_path(self.backend)):
+                    if INDEX_AUTO_BUILD and total >= INDEX_TRAIN_MIN:
+                        self._build(self.backend, total)
+                elif total - covered >= INDEX_MERGE_TAIL:
+                    template = faiss.read_index(self._template_path(self.backend))
+                    ids = np.arange(covered, total, dtype=np.int64)
+                    _write_index(add_vectors(template, ids, self.cache.vectors),
+                                 self._segment_path(self.backend, covered, total))
+                    logger.info(f"🧩 Индекс {self.backend}: +сегмент {covered}–{total}, всего {len(chain) + 1}")
+        except Exception as e:
+            logger.warning(f"⚠️ Фоновое обновление индекса не удалось (поиск идёт точно по кэшу): {e}")
+        finally:
+            with self._lock:
+                self._merging = False
+
+    def _build(self, backend: str, total: int):
+        """Обучает индекс на выборке и пишет один сегмент 0..total; прочие сегменты бэкенда удаляются."""
+        logger.info(f"🏗️ Строим индекс {backend}: {total} векторов")
+        ids = np.arange(total, dtype=np.int64)
+        index = train_index(backend, ids, self.cache.vectors, self.cache.dim)
+        _write_index(index, self._template_path(backend))
+        segment_path = self._segment_path(backend, 0, total)
+        _write_index(add_vectors(index, ids, self.cache.vectors), segment_path)
+        for _, _, name in self._segment_files(backend):
+            path = os.path.join(self.cache.dir, name)
+            if path != segment_path:
+                os.remove(path)
+        legacy = os.path.join(self.cache.dir, "index.faiss")  # единый индекс прошлых версий
+        if os.path.exists(legacy):
+            os.remove(legacy)
+
+    def rebuild(self, backend: str = None) -> int:
+        """
+        Перестраивает индекс из всех векторов кэша одним сегментом (например, офлайн перед
+        переключением бэкенда или чтобы слить накопившиеся сегменты). Возвращает число векторов.
+        """
+        backend = backend or self.backend
+        total = len(self.cache)
+        if backend == "flat" or total == 0:
+            logger.info("🗂️ flat не нуждается в сборке: поиск идёт прямо по кэшу эмбеддингов")
+            return total
+        if total < INDEX_TRAIN_MIN:
+            logger.warning(f"⚠️ {total} векторов меньше INDEX_TRAIN_MIN={INDEX_TRAIN_MIN} — индекс не строим")
+            return total
+        with file_lock(self.lock_path):
+            self._build(backend, total)
+        return total
+
+    def _exact_search(self, queries: np.ndarray, k: int, ids: np.ndarray):
+        """Точный поиск прямо по векторам кэша (memmap), пачками по ADD_BATCH строк."""
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for start in range(0, len(ids), ADD_BATCH):
+            batch = ids[start:start + ADD_BATCH]
+            scores = np.concatenate([best_scores, queries @ self.cache.vectors(batch).T], axis=1)
+            candidates = np.concatenate([best_ids, np.broadcast_to(batch, (len(queries), len(batch)))], axis=1)
+            order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+            best_scores = np.take_along_axis(scores, order, axis=1)
+            best_ids = np.take_along_axis(candidates, order, axis=1)
+        return best_scores, best_ids
+
+    def _refine(self, queries: np.ndarray, k: int, candidates: np.ndarray):
+        """Точный косинус для кандидатов (k на сегмент и хвост) и лучшие k из них."""
+        out_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, query in enumerate(queries):
+            ids = np.unique(candidates[row][candidates[row] >= 0])
+            if len(ids) == 0:
+                continue
+            scores = self.cache.vectors(ids) @ query
+            order = np.argsort(-scores, kind="stable")[:k]
+            out_scores[row, :len(order)] = scores[order]
+            out_ids[row, :len(order)] = ids[order]
+        return out_scores, out_ids
+
+    def search(self, queries: np.ndarray, k: int, subset=None):
+        """
+        Ищет k ближайших для каждой строки queries (нормированные векторы).
+        subset — ID, среди которых искать. Возвращает (scores, ids), -1 в ids — пустая позиция.
+        Подмножество всегда ищется точно по кэшу; сегменты — только для поиска по всему корпусу.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if subset is not None:
+            return self._exact_search(queries, k, np.unique(np.asarray(subset, dtype=np.int64)))
+        segments, covered = self._open()
+        tail = np.arange(covered, len(self.cache), dtype=np.int64)
+        if not segments:
+            return self._exact_search(queries, k, tail)
+
+        candidates = [index.search(queries, k, params=search_params(index))[1] for index in segments]
+        if len(tail):
+            candidates.append(self._exact_search(queries, k, tail)[1])
+        return self._refine(queries, k, np.concatenate(candidates, axis=1))
+
+    def stats(self) -> dict:
+        chain, covered = self._chain()
+        return {"backend": self.backend, "segments": len(chain), "indexed": covered,
+                "exact_tail": len(self.cache) - covered}
+
+    def __len__(self):
+        return len(self.cache)